@@ -0,0 +1,77 @@
+"""出站帧编码微基准：对比逐帧 json.dumps 与“消息体只编码一次”的方式。
+
+运行：python -m bench.bench_frames [--recipients 3] [--number 20000]
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from server import frames
+
+
+MESSAGE = {
+    "id": 123456789,
+    "sender_id": 42,
+    "receiver_id": 4242,
+    "body": "你好，这是一条用于基准测试的聊天消息 hello world " * 2,
+    "created_at": datetime(2024, 1, 1, 12, 0, 0, 123456),
+}
+
+
+def per_frame(recipients: int) -> None:
+    # 旧实现：sent 与每个接收端各自构造 dict 并 send_json（stdlib json）
+    for frame_type in ["sent"] + ["recv"] * recipients:
+        json.dumps(
+            {
+                "type": frame_type,
+                "message": {
+                    "id": MESSAGE["id"],
+                    "sender_id": MESSAGE["sender_id"],
+                    "receiver_id": MESSAGE["receiver_id"],
+                    "body": MESSAGE["body"],
+                    "created_at": MESSAGE["created_at"].isoformat(),
+                },
+            },
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+
+
+def encode_once(recipients: int) -> None:
+    payload = frames.dumps(
+        {
+            "id": MESSAGE["id"],
+            "sender_id": MESSAGE["sender_id"],
+            "receiver_id": MESSAGE["receiver_id"],
+            "body": MESSAGE["body"],
+            "created_at": MESSAGE["created_at"].isoformat(),
+        }
+    )
+    frames.message_frame("sent", payload)
+    # 同一个 recv 字符串被所有接收端复用
+    frames.message_frame("recv", payload)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=3)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    backend = "orjson" if frames.orjson is not None else "stdlib json"
+    print(f"backend: {backend}, recipient sockets per message: {args.recipients}")
+    results = {}
+    for name, fn in (("per-frame json.dumps", per_frame), ("encode once", encode_once)):
+        best = min(
+            timeit.repeat(lambda: fn(args.recipients), number=args.number, repeat=5)
+        )
+        results[name] = best / args.number * 1e6
+        print(f"{name:>22}: {results[name]:.2f} µs/message")
+    base, new = results["per-frame json.dumps"], results["encode once"]
+    print(f"{'reduction':>22}: {(1 - new / base) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
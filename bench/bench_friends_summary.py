@@ -0,0 +1,131 @@
+"""好友概览查询基准：好友数增长时 /friends/summary 单条查询的耗时。
+
+在 DATABASE_URL 指向的库中为每个规模造一个用户及其 N 个好友（每个会话若干条消息、
+一半好友有已读水位），测量概览查询与逐个好友查询（N+1）的耗时，结束后删除造的数据。
+运行：python -m bench.bench_friends_summary [--friends 100 1000 5000] [--messages 5]
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import delete, func, insert, select
+
+from server.api import _friends_summary_stmt
+from server.db import SessionLocal, init_db
+from server.models import Friendship, Message, ReadMarker, User, conversation_key
+
+
+def seed(friends: int, messages: int) -> List[int]:
+    tag = uuid.uuid4().hex[:8]
+    with SessionLocal() as db:
+        users = [
+            {
+                "email": f"bench-{tag}-{i}@example.com",
+                "password_hash": "x",
+                "display_name": f"bench {i:05d}",
+                "created_at": datetime.utcnow(),
+            }
+            for i in range(friends + 1)
+        ]
+        ids = list(db.execute(insert(User).returning(User.id), users).scalars())
+        owner, others = ids[0], ids[1:]
+        db.execute(
+            insert(Friendship),
+            [{"user_id": owner, "friend_user_id": f} for f in others]
+            + [{"user_id": f, "friend_user_id": owner} for f in others],
+        )
+        rows = []
+        for f in others:
+            key = conversation_key(owner, f)
+            for n in range(messages):
+                sender, receiver = (f, owner) if n % 2 == 0 else (owner, f)
+                rows.append(
+                    {
+                        "sender_id": sender,
+                        "receiver_id": receiver,
+                        "conversation_key": key,
+                        "body": f"hello {n}",
+                        "client_msg_id": uuid.uuid4().hex,
+                        "created_at": datetime.utcnow(),
+                    }
+                )
+        db.execute(insert(Message), rows)
+        # 一半好友的会话已读到倒数第二条
+        read_keys = [conversation_key(owner, f) for f in others[::2]]
+        marks = db.execute(
+            select(Message.conversation_key, func.max(Message.id) - 1)
+            .where(Message.conversation_key.in_(read_keys))
+            .group_by(Message.conversation_key)
+        ).all()
+        if marks:
+            db.execute(
+                insert(ReadMarker),
+                [
+                    {"user_id": owner, "conversation_key": k, "last_read_id": m}
+                    for k, m in marks
+                ],
+            )
+        db.commit()
+    return ids
+
+
+def time_summary(owner: int, rounds: int) -> float:
+    samples = []
+    with SessionLocal() as db:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            db.execute(_friends_summary_stmt(owner)).all()
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def time_n_plus_one(owner: int, friends: List[int]) -> float:
+    # 对照组：客户端逐个好友取最后一条消息与未读数
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        for f in friends:
+            key = conversation_key(owner, f)
+            db.execute(
+                select(Message)
+                .where(Message.conversation_key == key)
+                .order_by(Message.id.desc())
+                .limit(1)
+            ).first()
+            db.execute(
+                select(func.count())
+                .select_from(Message)
+                .where(Message.conversation_key == key, Message.sender_id == f)
+            ).scalar()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--friends", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    init_db()
+    for friends in args.friends:
+        ids = seed(friends, args.messages)
+        try:
+            summary = time_summary(ids[0], args.rounds)
+            naive = time_n_plus_one(ids[0], ids[1:])
+            print(
+                f"{friends:>6} friends: summary {summary * 1000:8.2f} ms "
+                f"({summary / friends * 1e6:6.1f} us/friend), "
+                f"N+1 {naive * 1000:9.2f} ms"
+            )
+        finally:
+            with SessionLocal() as db:
+                db.execute(delete(User).where(User.id.in_(ids)))
+                db.commit()
+
+
+if __name__ == "__main__":
+    main()
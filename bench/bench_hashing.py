@@ -0,0 +1,81 @@
+"""登录吞吐基准：不同进程池大小下 pbkdf2 校验的每秒次数。
+
+模拟事件循环上的并发登录请求（与异步的 /auth/login 一致，并发不受线程池上限约束），
+逐个池大小测量 verify_password 吞吐，以及排队超过 --max-pending 时被拒绝（503）的次数。
+吞吐只计完成校验的登录；有拒绝时被拒绝的请求几乎不耗时，该结果不能当作吞吐数据，
+因此默认并发不超过排队上限。
+运行：python -m bench.bench_hashing [--logins 200] [--concurrency 64] [--max-pending 64]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from server.security import HashPool, HashPoolBusy, _hash, _verify
+
+
+async def measure(
+    pool_size: int,
+    logins: int,
+    concurrency: int,
+    max_pending: int,
+    password_hash: str,
+) -> tuple[int, int, int, float]:
+    pool = HashPool(workers=pool_size, max_pending=max_pending)
+    pool.start()
+    # 预热：让所有子进程完成启动与导入
+    await asyncio.gather(
+        *(pool.run(_verify, "pw", password_hash) for _ in range(pool_size))
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login() -> str:
+        async with semaphore:
+            try:
+                ok = await pool.run(_verify, "secret-password", password_hash)
+            except HashPoolBusy:
+                return "rejected"
+            return "ok" if ok else "failed"
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    # (完成校验数, 被拒绝数, 校验失败数, 耗时)
+    return (
+        results.count("ok"),
+        results.count("rejected"),
+        results.count("failed"),
+        elapsed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    password_hash = _hash("secret-password")
+    cores = os.cpu_count() or 1
+    sizes = sorted({1, 2, 4, cores // 2 or 1, cores, cores * 2})
+    print(
+        f"cores: {cores}, logins: {args.logins}, concurrency: {args.concurrency}, "
+        f"max pending: {args.max_pending}"
+    )
+    for size in sizes:
+        completed, rejected, failed, elapsed = asyncio.run(
+            measure(
+                size, args.logins, args.concurrency, args.max_pending, password_hash
+            )
+        )
+        line = f"pool size {size:>3}: {completed / elapsed:8.1f} logins/s"
+        if rejected or failed:
+            line += f"  (rejected {rejected}, failed {failed}: not a throughput number)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""群消息扇出基准：一条消息发给 N 个在线成员的 CPU 耗时。
+
+在进程内注册 N 个成员连接（另有若干不在群里的在线用户），成员集合直接写入缓存，
+测量“编码一次 + 入队到所有成员连接”的耗时，并与每个成员单独编码的方式对比。
+不需要数据库；连接的写任务不启动，只测发送路径本身。
+运行：python -m bench.bench_room_fanout [--members 5000] [--others 20000] [--number 200]
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from server import frames
+from server.config import settings
+from server.rooms import rooms
+from server.ws import _message_payload, deliver_room_local, registry
+
+
+ROOM_ID = 1
+
+MESSAGE = {
+    "id": 123456789,
+    "sender_id": 1,
+    "receiver_id": None,
+    "conversation_key": f"g:{ROOM_ID}",
+    "body": "大家好，这是一条用于基准测试的群消息 hello everyone " * 2,
+    "client_msg_id": "bench-client-msg-id",
+    "created_at": datetime(2024, 1, 1, 12, 0, 0, 123456),
+}
+
+
+class _NullWebSocket:
+    async def send_text(self, data: str) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+async def encode_once(number: int) -> float:
+    start = time.perf_counter()
+    for i in range(number):
+        payload = frames.dumps(_message_payload({**MESSAGE, "id": MESSAGE["id"] + i}))
+        await deliver_room_local(
+            ROOM_ID, frames.message_frame("recv", payload), None, MESSAGE["id"] + i
+        )
+    return time.perf_counter() - start
+
+
+async def per_member(number: int) -> float:
+    # 对照组：为每个成员连接各自构造并编码一次帧
+    members = await rooms.members(ROOM_ID)
+    start = time.perf_counter()
+    for i in range(number):
+        message = {**MESSAGE, "id": MESSAGE["id"] + i}
+        for conn in registry.for_users(members):
+            frame = frames.dumps(
+                {"type": "recv", "message": _message_payload(message)}
+            )
+            conn.send(frame, message["id"])
+    return time.perf_counter() - start
+
+
+async def run(members: int, others: int, number: int) -> None:
+    # 队列足够大，基准期间不触发慢消费者处理
+    settings.ws_send_queue_max = number * 2 + 1
+    ws = _NullWebSocket()
+    for user_id in range(1, members + others + 1):
+        registry.register(user_id, ws)  # type: ignore[arg-type]
+    rooms.set(ROOM_ID, frozenset(range(1, members + 1)))
+
+    backend = "orjson" if frames.orjson is not None else "stdlib json"
+    print(
+        f"backend: {backend}, members online: {members}, "
+        f"other users online: {others}, messages: {number}"
+    )
+    for name, fn in (("encode once", encode_once), ("per-member encode", per_member)):
+        elapsed = await fn(number)
+        per_message = elapsed / number
+        print(
+            f"{name:>18}: {per_message * 1000:7.3f} ms/broadcast "
+            f"({per_message / members * 1e9:6.1f} ns/recipient)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--others", type=int, default=20000)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.members, args.others, args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""端到端 WebSocket 压测：模拟大量在线用户，测量吞吐、send→recv 延迟与建连速率。
+
+复用桌面客户端的 AsyncApiClient（注册 / 登录 / 建群）与 WSClient（auth、send、ack 帧、
+重连与去重），所有模拟用户运行在同一个 asyncio 事件循环中。需要一个正在运行的服务端
+（python -m server.main，指向本地 Postgres）；每次运行注册一批新的压测用户。
+
+聊天模式：
+  pairs  两两配对互发消息（1:1 会话）
+  room   每 --room-size 人一个群，群内任意成员发言，扇出给其他成员
+
+运行：python -m bench.loadgen [--users 1000] [--duration 30] [--rate 0.5] [--pattern pairs]
+大量连接需要足够的文件描述符（如 ulimit -n 65535）。
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from client.api import AsyncApiClient
+from client.ws import WSClient, direct_key, room_key
+
+
+PASSWORD = "loadgen-password"
+# 注册 / 登录遇到 503（服务端密码哈希排队已满）时的最多尝试次数
+SETUP_ATTEMPTS = 10
+T = TypeVar("T")
+# 消息体前缀，后接发送时刻（perf_counter_ns），接收方据此计算延迟
+BODY_PREFIX = "lg:"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def retry_busy(call: Callable[[], Awaitable[T]]) -> T:
+    # 服务端过载时按 Retry-After 等待后重试，而不是把这个用户记为建连失败
+    for attempt in range(SETUP_ATTEMPTS):
+        try:
+            return await call()
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 503 or attempt == SETUP_ATTEMPTS - 1:
+                raise
+            delay = float(e.response.headers.get("Retry-After", "1"))
+            await asyncio.sleep(delay + random.uniform(0, delay))
+    raise AssertionError("unreachable")
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.connect_times: List[float] = []
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.received = 0
+        self.send_errors = 0
+        self.setup_errors = 0
+
+
+class SimUser:
+    """一个模拟用户：一个 WSClient 连接，按泊松过程向目标会话发送消息。"""
+
+    def __init__(self, index: int, email: str, stats: Stats) -> None:
+        self.index = index
+        self.email = email
+        self.stats = stats
+        self.user_id = 0
+        self.token = ""
+        self.ws: Optional[WSClient] = None
+        self.peer_id: Optional[int] = None
+        self.room_id: Optional[int] = None
+        self._ready: Optional[asyncio.Future[None]] = None
+
+    async def setup(self, api_base: str) -> None:
+        api = AsyncApiClient(api_base)
+        try:
+            await retry_busy(
+                lambda: api.register(self.email, PASSWORD, f"loadgen {self.index}")
+            )
+            self.token = await retry_busy(lambda: api.login(self.email, PASSWORD))
+            self.user_id = (await api.me())["id"]
+        finally:
+            await api.aclose()
+
+    async def connect(self, ws_url: str, timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        self._ready = loop.create_future()
+        ws = WSClient(ws_url)
+        ws.set_token(self.token)
+        ws.on_ready = self._on_ready
+        if self.room_id is not None:
+            ws.subscribe(room_key(self.room_id), self.on_messages)
+        elif self.peer_id is not None:
+            ws.subscribe(direct_key(self.user_id, self.peer_id), self.on_messages)
+        self.ws = ws
+        start = time.perf_counter()
+        await ws.connect()
+        try:
+            # WSClient 在后台无限重连：服务端拒绝或过载时不会自行失败，超时记为建连失败
+            await asyncio.wait_for(self._ready, timeout)
+        except asyncio.TimeoutError:
+            await ws.close()
+            self.ws = None
+            raise
+        self.stats.connect_times.append(time.perf_counter() - start)
+
+    def _on_ready(self) -> None:
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_result(None)
+
+    def on_messages(self, messages: List[Dict[str, Any]]) -> None:
+        now = time.perf_counter_ns()
+        for m in messages:
+            if m["sender_id"] == self.user_id:
+                continue
+            body = m["body"]
+            if not body.startswith(BODY_PREFIX):
+                continue
+            self.stats.received += 1
+            self.stats.latencies.append((now - int(body[len(BODY_PREFIX) :])) / 1e9)
+
+    async def chat(self, rate: float, until: float) -> None:
+        assert self.ws is not None
+        # 错开起步，避免所有用户同时发送第一条
+        await asyncio.sleep(random.uniform(0, 1 / rate))
+        while time.perf_counter() < until:
+            body = f"{BODY_PREFIX}{time.perf_counter_ns()}"
+            try:
+                if self.room_id is not None:
+                    await self.ws.send_room_message(self.room_id, body)
+                else:
+                    assert self.peer_id is not None
+                    await self.ws.send_message(self.peer_id, body)
+                self.stats.sent += 1
+            except RuntimeError:
+                # 发送缓冲已满（连接断开过久）
+                self.stats.send_errors += 1
+            await asyncio.sleep(random.expovariate(rate))
+
+
+async def _gather_limited(coros: List[Any], limit: int) -> List[Any]:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro: Any) -> Any:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros), return_exceptions=True)
+
+
+async def run(args: argparse.Namespace) -> None:
+    stats = Stats()
+    tag = uuid.uuid4().hex[:8]
+    users = [
+        SimUser(i, f"loadgen-{tag}-{i}@example.com", stats) for i in range(args.users)
+    ]
+
+    print(f"registering {len(users)} users ...")
+    results = await _gather_limited(
+        [u.setup(args.api) for u in users], args.setup_concurrency
+    )
+    failed = [u for u, r in zip(users, results) if isinstance(r, Exception)]
+    stats.setup_errors += len(failed)
+    users = [u for u, r in zip(users, results) if not isinstance(r, Exception)]
+    if len(users) < 2:
+        raise SystemExit("not enough users registered, is the server running?")
+
+    if args.pattern == "pairs":
+        for a, b in zip(users[::2], users[1::2]):
+            a.peer_id, b.peer_id = b.user_id, a.user_id
+        users = [u for u in users if u.peer_id is not None]
+    else:
+        api = AsyncApiClient(args.api)
+        try:
+            for start in range(0, len(users), args.room_size):
+                group = users[start : start + args.room_size]
+                api.set_token(group[0].token)
+                room = await api.create_room(
+                    f"loadgen {tag} {start}", [u.user_id for u in group[1:]]
+                )
+                for u in group:
+                    u.room_id = room["id"]
+        finally:
+            await api.aclose()
+
+    print(f"connecting {len(users)} sockets ...")
+    start = time.perf_counter()
+    results = await _gather_limited(
+        [u.connect(args.ws, args.connect_timeout) for u in users],
+        args.setup_concurrency,
+    )
+    connect_elapsed = time.perf_counter() - start
+    stats.setup_errors += sum(1 for r in results if isinstance(r, Exception))
+    connected = [u for u, r in zip(users, results) if not isinstance(r, Exception)]
+
+    print(f"chatting for {args.duration}s ({args.pattern}, {args.rate} msg/s/user)")
+    chat_start = time.perf_counter()
+    until = chat_start + args.duration
+    await asyncio.gather(*(u.chat(args.rate, until) for u in connected))
+    # 等待在途消息送达
+    await asyncio.sleep(args.grace)
+    chat_elapsed = time.perf_counter() - chat_start
+
+    for u in connected:
+        if u.ws is not None:
+            await u.ws.close()
+
+    report(stats, len(users), len(connected), connect_elapsed, chat_elapsed)
+
+
+def report(
+    stats: Stats,
+    users: int,
+    connected: int,
+    connect_elapsed: float,
+    chat_elapsed: float,
+) -> None:
+    def ms(samples: List[float], p: float) -> str:
+        return f"{percentile(samples, p) * 1000:.2f} ms"
+
+    connect, latency = stats.connect_times, stats.latencies
+    print()
+    print(
+        f"sockets connected:  {connected} / {users} "
+        f"({stats.setup_errors} setup errors)"
+    )
+    print(
+        f"connection setup:   {connected / connect_elapsed:.1f} conn/s, "
+        f"p50 {ms(connect, 0.5)}, p99 {ms(connect, 0.99)}"
+    )
+    print(
+        f"messages sent:      {stats.sent} ({stats.sent / chat_elapsed:.1f} msg/s, "
+        f"{stats.send_errors} errors)"
+    )
+    print(
+        f"messages received:  {stats.received} "
+        f"({stats.received / chat_elapsed:.1f} msg/s)"
+    )
+    print(
+        f"send->recv latency: p50 {ms(latency, 0.5)}, p99 {ms(latency, 0.99)}, "
+        f"p999 {ms(latency, 0.999)}, max {ms(latency, 1.0)}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--ws", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument(
+        "--rate", type=float, default=0.5, help="每个用户每秒发送的消息数"
+    )
+    parser.add_argument("--pattern", choices=("pairs", "room"), default="pairs")
+    parser.add_argument("--room-size", type=int, default=50)
+    # 低于服务端 hash_queue_max（默认 64），注册登录不会因排队已满被拒绝
+    parser.add_argument("--setup-concurrency", type=int, default=32)
+    parser.add_argument(
+        "--connect-timeout", type=float, default=10.0, help="单个连接等待 ready 的秒数"
+    )
+    parser.add_argument(
+        "--grace", type=float, default=2.0, help="停止发送后等待在途消息的秒数"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
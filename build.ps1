@@ -1 +1 @@
-Remove-Item -Recurse -Force build,dist -ErrorAction SilentlyContinue; py -3.12-64 -m venv .rt; .\.rt\Scripts\python -m pip install -U pip wheel pyinstaller==6.16.0 PyQt6==6.7.1 PyQt6-Qt6==6.7.3 websockets httpx python-dotenv; .\.rt\Scripts\pyinstaller --noconfirm --clean --name socket-chat-client --onedir --windowed --collect-all PyQt6 client\main.py; .\dist\socket-chat-client\socket-chat-client.exe
\ No newline at end of file
+Remove-Item -Recurse -Force build,dist -ErrorAction SilentlyContinue; py -3.12-64 -m venv .rt; .\.rt\Scripts\python -m pip install -U pip wheel pyinstaller==6.16.0 PyQt6==6.7.1 PyQt6-Qt6==6.7.3 websockets "httpx[http2]" python-dotenv; .\.rt\Scripts\pyinstaller --noconfirm --clean --name socket-chat-client --onedir --windowed --collect-all PyQt6 client\main.py; .\dist\socket-chat-client\socket-chat-client.exe
\ No newline at end of file
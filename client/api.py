@@ -1,13 +1,40 @@
+import importlib.util
 from typing import Any, Dict, Optional
 
 import httpx
 
 
-class ApiClient:
+# HTTP/2 需要可选依赖 h2（httpx[http2]）；缺失时退回 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _history_params(
+    before_id: Optional[int], after_id: Optional[int], limit: int
+) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"limit": limit}
+    if before_id is not None:
+        params["before_id"] = before_id
+    if after_id is not None:
+        params["after_id"] = after_id
+    return params
+
+
+class AsyncApiClient:
+    """REST 客户端：须在 AsyncioRunner 的事件循环上调用，不阻塞 Qt 主线程。
+
+    底层 httpx.AsyncClient 复用 keep-alive 连接（可用时走 HTTP/2 多路复用），
+    多个请求可以 asyncio.gather 并发执行。
+    """
+
     def __init__(self, base_url: str) -> None:
         self.base_url = base_url.rstrip("/")
         self.token: Optional[str] = None
-        self._client = httpx.Client(base_url=self.base_url, timeout=10.0)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=10.0,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60.0),
+        )
 
     def set_token(self, token: Optional[str]) -> None:
         self.token = token
@@ -18,8 +45,13 @@ class ApiClient:
             headers["Authorization"] = f"Bearer {self.token}"
         return headers
 
-    def register(self, email: str, password: str, display_name: str) -> Dict[str, Any]:
-        res = self._client.post(
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def register(
+        self, email: str, password: str, display_name: str
+    ) -> Dict[str, Any]:
+        res = await self._client.post(
             "/api/auth/register",
             headers=self._headers(),
             json={"email": email, "password": password, "display_name": display_name},
@@ -27,8 +59,8 @@ class ApiClient:
         res.raise_for_status()
         return res.json()
 
-    def login(self, email: str, password: str) -> str:
-        res = self._client.post(
+    async def login(self, email: str, password: str) -> str:
+        res = await self._client.post(
             "/api/auth/login",
             headers=self._headers(),
             json={"email": email, "password": password},
@@ -38,18 +70,58 @@ class ApiClient:
         self.set_token(token)
         return token
 
-    def me(self) -> Dict[str, Any]:
-        res = self._client.get("/api/me", headers=self._headers())
+    async def me(self) -> Dict[str, Any]:
+        res = await self._client.get("/api/me", headers=self._headers())
         res.raise_for_status()
         return res.json()
 
-    def friends(self) -> list[Dict[str, Any]]:
-        res = self._client.get("/api/friends", headers=self._headers())
+    async def friends_summary(self) -> list[Dict[str, Any]]:
+        # 好友列表连同每个会话的最后一条消息与未读数，一次请求
+        res = await self._client.get("/api/friends/summary", headers=self._headers())
         res.raise_for_status()
         return res.json()
 
-    def add_friend(self, friend_email: str) -> Dict[str, Any]:
-        res = self._client.post(
+    async def mark_read(self, friend_id: int, up_to: int) -> None:
+        res = await self._client.post(
+            f"/api/messages/{friend_id}/read",
+            headers=self._headers(),
+            json={"up_to": up_to},
+        )
+        res.raise_for_status()
+
+    async def rooms(self) -> list[Dict[str, Any]]:
+        res = await self._client.get("/api/rooms", headers=self._headers())
+        res.raise_for_status()
+        return res.json()
+
+    async def create_room(
+        self, title: str, member_ids: Optional[list[int]] = None
+    ) -> Dict[str, Any]:
+        res = await self._client.post(
+            "/api/rooms",
+            headers=self._headers(),
+            json={"title": title, "member_ids": member_ids or []},
+        )
+        res.raise_for_status()
+        return res.json()
+
+    async def room_history(
+        self,
+        room_id: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> Dict[str, Any]:
+        res = await self._client.get(
+            f"/api/rooms/{room_id}/messages",
+            headers=self._headers(),
+            params=_history_params(before_id, after_id, limit),
+        )
+        res.raise_for_status()
+        return res.json()
+
+    async def add_friend(self, friend_email: str) -> Dict[str, Any]:
+        res = await self._client.post(
             "/api/friends/add",
             headers=self._headers(),
             json={"friend_email": friend_email},
@@ -57,7 +129,17 @@ class ApiClient:
         res.raise_for_status()
         return res.json()
 
-    def history(self, friend_id: int) -> list[Dict[str, Any]]:
-        res = self._client.get(f"/api/messages/{friend_id}", headers=self._headers())
+    async def history(
+        self,
+        friend_id: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> Dict[str, Any]:
+        res = await self._client.get(
+            f"/api/messages/{friend_id}",
+            headers=self._headers(),
+            params=_history_params(before_id, after_id, limit),
+        )
         res.raise_for_status()
         return res.json()
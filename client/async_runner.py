@@ -1,6 +1,6 @@
 import asyncio
 import threading
-from typing import Optional
+from typing import Any, Callable, Optional
 
 
 class AsyncioRunner:
@@ -9,6 +9,7 @@ class AsyncioRunner:
     def __init__(self) -> None:
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
 
     @classmethod
     def instance(cls) -> "AsyncioRunner":
@@ -24,10 +25,14 @@ class AsyncioRunner:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             self._loop = loop
+            loop.call_soon(self._started.set)
             loop.run_forever()
 
+        self._started.clear()
         self._thread = threading.Thread(target=_run, name="asyncio-runner", daemon=True)
         self._thread.start()
+        # 等事件循环就绪后再返回，避免紧接着的 create_task 拿不到 loop
+        self._started.wait(timeout=5.0)
 
     def stop(self) -> None:
         if self._loop and self._loop.is_running():
@@ -39,3 +44,9 @@ class AsyncioRunner:
         if not self._loop:
             raise RuntimeError("AsyncioRunner not started")
         return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call_soon(self, fn: Callable[..., Any], *args: Any) -> None:
+        # 在事件循环线程中执行普通函数：只由该线程修改的状态（如 WSClient 的订阅表）从 Qt 线程经此修改
+        if not self._loop:
+            raise RuntimeError("AsyncioRunner not started")
+        self._loop.call_soon_threadsafe(fn, *args)
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# 本地缓存目录与容量上限（总消息条数，超出后按最近访问时间淘汰整个会话）
+CACHE_DIR = Path(
+    os.environ.get("CLIENT_CACHE_DIR", str(Path.home() / ".socket-chat" / "cache"))
+)
+CACHE_MAX_MESSAGES = int(os.environ.get("CLIENT_CACHE_MAX_MESSAGES", "200000"))
+CACHE_ENABLED = os.environ.get("CLIENT_CACHE", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+    "off",
+)
+
+_COLUMNS = ("id", "sender_id", "receiver_id", "body", "client_msg_id", "created_at")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    conversation TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    sender_id INTEGER NOT NULL,
+    receiver_id INTEGER,
+    body TEXT NOT NULL,
+    client_msg_id TEXT,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (conversation, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation TEXT PRIMARY KEY,
+    last_access REAL NOT NULL,
+    has_older INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+
+class MessageCache:
+    """按用户分库的本地消息缓存（SQLite），主键为 (会话 id, 消息 id)。
+
+    每个会话缓存的是一段连续的消息：最新一页、之后拉取的增量与向上翻页的结果，
+    has_older 记录这段之前服务端是否还有更早的消息。仅在 Qt 主线程使用。
+    """
+
+    def __init__(self, path: Path, max_messages: int = CACHE_MAX_MESSAGES) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_messages = max_messages
+        self._db = sqlite3.connect(str(path))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @classmethod
+    def for_user(cls, api_base: str, user_id: int) -> Optional["MessageCache"]:
+        # 不同服务端的用户 id 可能重复：文件名带上服务地址的摘要
+        if not CACHE_ENABLED:
+            return None
+        server = hashlib.sha1(api_base.encode("utf-8")).hexdigest()[:12]
+        try:
+            return cls(CACHE_DIR / f"{server}-{user_id}.sqlite3")
+        except (OSError, sqlite3.Error):
+            # 缓存不可用时退回纯网络加载
+            return None
+
+    def close(self) -> None:
+        self._db.close()
+
+    def touch(self, conversation: str) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT INTO conversations (conversation, last_access) VALUES (?, ?) "
+                "ON CONFLICT (conversation) "
+                "DO UPDATE SET last_access = excluded.last_access",
+                (conversation, time.time()),
+            )
+
+    def has_older(self, conversation: str) -> bool:
+        row = self._db.execute(
+            "SELECT has_older FROM conversations WHERE conversation = ?",
+            (conversation,),
+        ).fetchone()
+        return row is None or bool(row["has_older"])
+
+    def set_has_older(self, conversation: str, has_older: bool) -> None:
+        with self._db:
+            self._db.execute(
+                "UPDATE conversations SET has_older = ? WHERE conversation = ?",
+                (int(has_older), conversation),
+            )
+
+    def latest(self, conversation: str, limit: int) -> List[Dict[str, Any]]:
+        """最新的 limit 条，最新在前（与服务端分页顺序一致）。"""
+        rows = self._db.execute(
+            "SELECT * FROM messages WHERE conversation = ? ORDER BY id DESC LIMIT ?",
+            (conversation, limit),
+        )
+        return [self._row(r) for r in rows]
+
+    def before(
+        self, conversation: str, before_id: int, limit: int
+    ) -> List[Dict[str, Any]]:
+        rows = self._db.execute(
+            "SELECT * FROM messages WHERE conversation = ? AND id < ? "
+            "ORDER BY id DESC LIMIT ?",
+            (conversation, before_id, limit),
+        )
+        return [self._row(r) for r in rows]
+
+    def add(self, conversation: str, messages: Iterable[Dict[str, Any]]) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO messages (conversation, id, sender_id, receiver_id, "
+                "body, client_msg_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(conversation, *(m.get(c) for c in _COLUMNS)) for m in messages],
+            )
+
+    def reset(self, conversation: str) -> None:
+        with self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE conversation = ?", (conversation,)
+            )
+            self._db.execute(
+                "UPDATE conversations SET has_older = 1 WHERE conversation = ?",
+                (conversation,),
+            )
+
+    def evict(self, keep: Iterable[str] = ()) -> int:
+        """超出容量时按最近访问时间从旧到新淘汰整个会话（keep 中的会话除外），返回淘汰数。"""
+        total = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if total <= self.max_messages:
+            return 0
+        keep = set(keep)
+        evicted = 0
+        rows = self._db.execute(
+            "SELECT conversation FROM conversations ORDER BY last_access"
+        ).fetchall()
+        with self._db:
+            for row in rows:
+                if total <= self.max_messages:
+                    break
+                conversation = row["conversation"]
+                if conversation in keep:
+                    continue
+                total -= self._db.execute(
+                    "DELETE FROM messages WHERE conversation = ?", (conversation,)
+                ).rowcount
+                self._db.execute(
+                    "DELETE FROM conversations WHERE conversation = ?", (conversation,)
+                )
+                evicted += 1
+        return evicted
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        return {c: row[c] for c in _COLUMNS}
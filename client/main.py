@@ -105,22 +105,11 @@ QListWidget#FriendsList::item:selected {
   background: #19213a;
 }
 
-/* 聊天气泡容器 */
-QFrame#BubbleMe {
-  background: #3b6df0;
-  border-radius: 12px;
-  padding: 8px 12px;
-  color: #ffffff;
-}
-QFrame#BubbleMe QLabel { background: transparent; color: #ffffff; }
-QFrame#BubblePeer {
-  background: #171c2b;
-  border-radius: 12px;
-  padding: 8px 12px;
-  color: #dfe3f1;
-  border: 1px solid #232d4b;
+/* 聊天气泡由 client/transcript.py 的 BubbleDelegate 绘制，配色与此处主题一致 */
+QListView#ChatArea {
+  border: none;
+  outline: none;
 }
-QFrame#BubblePeer QLabel { background: transparent; color: #dfe3f1; }
 
 /* 聊天区域背景与文本协调 */
 QWidget#ChatArea {
@@ -0,0 +1,176 @@
+import bisect
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+
+MessageRole = QtCore.Qt.ItemDataRole.UserRole + 1
+
+# 气泡配色与原 QSS（BubbleMe / BubblePeer）一致
+ME_BG = QtGui.QColor("#3b6df0")
+ME_FG = QtGui.QColor("#ffffff")
+PEER_BG = QtGui.QColor("#171c2b")
+PEER_FG = QtGui.QColor("#dfe3f1")
+PEER_BORDER = QtGui.QColor("#232d4b")
+
+
+class TranscriptModel(QtCore.QAbstractListModel):
+    """聊天记录模型：按消息 id 升序保存纯数据，不为每条消息创建控件。"""
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self._items: List[Dict[str, Any]] = []
+        self._ids: List[int] = []  # 与 _items 对齐，用于二分查找与去重
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._items)
+
+    def data(self, index: QtCore.QModelIndex, role: int = 0) -> Any:
+        if not index.isValid():
+            return None
+        m = self._items[index.row()]
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return m["body"]
+        if role == MessageRole:
+            return m
+        return None
+
+    def row_of(self, message_id: int) -> Optional[int]:
+        i = bisect.bisect_left(self._ids, message_id)
+        return i if i < len(self._ids) and self._ids[i] == message_id else None
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self._items.clear()
+        self._ids.clear()
+        self.endResetModel()
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> None:
+        # 比现有都旧/都新的部分各一次 beginInsertRows；落在中间的（少见）逐条二分插入
+        fresh = sorted(
+            {m["id"]: m for m in messages if self.row_of(m["id"]) is None}.values(),
+            key=lambda m: m["id"],
+        )
+        if not fresh:
+            return
+        if not self._ids:
+            self._insert_block(0, fresh)
+            return
+        fresh_ids = [m["id"] for m in fresh]
+        lo = bisect.bisect_left(fresh_ids, self._ids[0])
+        hi = bisect.bisect_right(fresh_ids, self._ids[-1])
+        if hi < len(fresh):
+            self._insert_block(len(self._items), fresh[hi:])
+        for m in fresh[lo:hi]:
+            self._insert_block(bisect.bisect_left(self._ids, m["id"]), [m])
+        if lo:
+            self._insert_block(0, fresh[:lo])
+
+    def _insert_block(self, row: int, block: List[Dict[str, Any]]) -> None:
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(block) - 1)
+        self._items[row:row] = block
+        self._ids[row:row] = [m["id"] for m in block]
+        self.endInsertRows()
+
+
+class BubbleDelegate(QtWidgets.QStyledItemDelegate):
+    """按需绘制聊天气泡；文本排版尺寸按 (消息 id, 可用宽度) 缓存，只为可见行绘制。"""
+
+    PAD_H = 12
+    PAD_V = 8
+    ROW_GAP = 6
+    SIDE_MARGIN = 10
+    MAX_WIDTH_RATIO = 0.7
+    RADIUS = 12.0
+    CACHE_MAX = 20000
+
+    def __init__(self, me_id: int, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self.me_id = me_id
+        self._sizes: "OrderedDict[Tuple[int, int], QtCore.QSize]" = OrderedDict()
+
+    def _text_width(self, view_width: int) -> int:
+        bubble = int(view_width * self.MAX_WIDTH_RATIO) - 2 * self.SIDE_MARGIN
+        return max(40, bubble - 2 * self.PAD_H)
+
+    def _text_size(
+        self, m: Dict[str, Any], width: int, metrics: QtGui.QFontMetrics
+    ) -> QtCore.QSize:
+        key = (m["id"], width)
+        size = self._sizes.get(key)
+        if size is not None:
+            self._sizes.move_to_end(key)
+            return size
+        rect = metrics.boundingRect(
+            QtCore.QRect(0, 0, width, 1_000_000),
+            int(QtCore.Qt.TextFlag.TextWordWrap),
+            m["body"],
+        )
+        size = rect.size()
+        self._sizes[key] = size
+        if len(self._sizes) > self.CACHE_MAX:
+            self._sizes.popitem(last=False)
+        return size
+
+    def sizeHint(
+        self, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex
+    ) -> QtCore.QSize:
+        m = index.data(MessageRole)
+        width = self._text_width(option.rect.width() or option.widget.width())
+        text = self._text_size(m, width, option.fontMetrics)
+        return QtCore.QSize(
+            option.rect.width(), text.height() + 2 * self.PAD_V + self.ROW_GAP
+        )
+
+    def paint(
+        self,
+        painter: QtGui.QPainter,
+        option: QtWidgets.QStyleOptionViewItem,
+        index: QtCore.QModelIndex,
+    ) -> None:
+        m = index.data(MessageRole)
+        me_side = m["sender_id"] == self.me_id
+        row = option.rect
+        text = self._text_size(m, self._text_width(row.width()), option.fontMetrics)
+        bubble_w = text.width() + 2 * self.PAD_H
+        bubble_h = text.height() + 2 * self.PAD_V
+        x = (
+            row.right() - self.SIDE_MARGIN - bubble_w
+            if me_side
+            else row.left() + self.SIDE_MARGIN
+        )
+        bubble = QtCore.QRectF(x, row.top() + self.ROW_GAP / 2, bubble_w, bubble_h)
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.setPen(QtGui.QPen(PEER_BORDER) if not me_side else QtCore.Qt.PenStyle.NoPen)
+        painter.setBrush(ME_BG if me_side else PEER_BG)
+        painter.drawRoundedRect(bubble, self.RADIUS, self.RADIUS)
+        painter.setPen(ME_FG if me_side else PEER_FG)
+        painter.drawText(
+            bubble.adjusted(self.PAD_H, self.PAD_V, -self.PAD_H, -self.PAD_V),
+            int(QtCore.Qt.TextFlag.TextWordWrap),
+            m["body"],
+        )
+        painter.restore()
+
+
+class TranscriptView(QtWidgets.QListView):
+    """虚拟化的聊天记录视图：只布局与绘制可见行，数万条消息也能流畅打开。"""
+
+    def __init__(self, me_id: int, parent: Optional[QtWidgets.QWidget] = None) -> None:
+        super().__init__(parent)
+        self.setObjectName("ChatArea")
+        self.transcript = TranscriptModel(self)
+        self.setModel(self.transcript)
+        self.setItemDelegate(BubbleDelegate(me_id, self))
+        self.setUniformItemSizes(False)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.NoSelection)
+        self.setResizeMode(QtWidgets.QListView.ResizeMode.Adjust)
+        # 分批布局：大量行的尺寸计算分散到多个事件循环周期，避免卡顿
+        self.setLayoutMode(QtWidgets.QListView.LayoutMode.Batched)
+        self.setBatchSize(200)
+        self.setWordWrap(True)
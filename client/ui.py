@@ -1,10 +1,14 @@
+import asyncio
 import os
-from typing import Any, Dict, Optional
+import uuid
+from typing import Any, Callable, Coroutine, Dict, Optional
 
 from PyQt6 import QtCore, QtWidgets
 
-from .api import ApiClient
-from .ws import WSClient
+from .api import AsyncApiClient
+from .cache import MessageCache
+from .transcript import MessageRole, TranscriptView
+from .ws import WSClient, direct_key
 from .async_runner import AsyncioRunner
 
 
@@ -15,6 +19,20 @@ SHOW_MSG = os.environ.get("CLIENT_SHOW_MESSAGES", "1").lower() not in (
     "off",
 )
 CLEAR_MS = int(os.environ.get("CLIENT_MSG_DURATION_MS", "3000"))
+HISTORY_PAGE_SIZE = int(os.environ.get("CLIENT_HISTORY_PAGE_SIZE", "50"))
+# 收到的消息先缓冲，按帧率合并刷新到视图（约 60fps），每批最多插入的条数
+UI_FLUSH_INTERVAL_MS = 16
+UI_FLUSH_MAX = 500
+# 打开窗口时从本地缓存显示后只拉取增量；增量超过这么多页则放弃缓存，改为重新加载最新一页
+DELTA_PAGE_SIZE = 200
+DELTA_MAX_PAGES = 10
+# 好友列表未读角标的显示上限（服务端最多计到上限 + 1），以及消息预览的最大字数
+UNREAD_BADGE_MAX = 99
+PREVIEW_CHARS = 40
+# 聊天窗口内已显示消息的已读水位合并上报间隔
+MARK_READ_DELAY_MS = 1000
+# 补发截断后重新加载失败时的重试间隔
+RESYNC_RETRY_MS = 2000
 
 
 def flash_label(label: QtWidgets.QLabel, text: str) -> None:
@@ -37,8 +55,17 @@ def friendly_error(ex: Exception) -> str:
         ("Cannot add self", "不能添加自己为好友"),
         ("403 Forbidden", "无权限执行该操作"),
         ("404", "未找到资源"),
+        ("503", "服务繁忙，请稍后重试"),
         ("timeout", "网络超时，请稍后重试"),
         ("Connection refused", "服务器不可用，请稍后再试"),
+        ("send buffer full", "待发送的消息过多，请稍后再试"),
+        ("WebSocket not connected", "未连接到服务器，请重新登录"),
+        ("Not a room member", "你已不是该群成员"),
+        ("Unknown recipient", "对方账号不存在"),
+        ("Invalid client_msg_id", "消息格式错误"),
+        ("Invalid recipient", "收件人无效"),
+        ("Invalid message", "消息格式错误"),
+        ("Send failed", "服务器暂时无法保存消息"),
     ]
     low = msg.lower()
     for key, zh in translations:
@@ -50,10 +77,60 @@ def friendly_error(ex: Exception) -> str:
     return "操作失败，请稍后重试"
 
 
+class AsyncCall(QtCore.QObject):
+    """在 AsyncioRunner 的事件循环上执行协程，结果通过信号回到 Qt 主线程。"""
+
+    _done = QtCore.pyqtSignal(object, object)
+
+    def __init__(
+        self,
+        parent: QtCore.QObject,
+        on_ok: Callable[[Any], None],
+        on_err: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._on_ok = on_ok
+        self._on_err = on_err
+        # 本对象属于主线程，跨线程 emit 时以排队方式在主线程调用 _deliver
+        self._done.connect(self._deliver)
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> None:
+        fut = AsyncioRunner.instance().create_task(coro)
+        fut.add_done_callback(self._on_future_done)
+
+    def _on_future_done(self, fut: Any) -> None:
+        if fut.cancelled():
+            return
+        error = fut.exception()
+        try:
+            self._done.emit(None if error else fut.result(), error)
+        except RuntimeError:
+            # 所属窗口已关闭，结果无人接收
+            pass
+
+    def _deliver(self, result: Any, error: Optional[Exception]) -> None:
+        try:
+            if error is None:
+                self._on_ok(result)
+            elif self._on_err is not None:
+                self._on_err(error)
+        finally:
+            self.deleteLater()
+
+
+def run_async(
+    parent: QtCore.QObject,
+    coro: Coroutine[Any, Any, Any],
+    on_ok: Callable[[Any], None],
+    on_err: Optional[Callable[[Exception], None]] = None,
+) -> None:
+    AsyncCall(parent, on_ok, on_err).run(coro)
+
+
 class LoginWindow(QtWidgets.QWidget):
     logged_in = QtCore.pyqtSignal(dict)
 
-    def __init__(self, api: ApiClient):
+    def __init__(self, api: AsyncApiClient):
         super().__init__()
         self.api = api
         self.setWindowTitle("登录 / 注册")
@@ -66,8 +143,8 @@ class LoginWindow(QtWidgets.QWidget):
         self.display_name = QtWidgets.QLineEdit()
         self.display_name.setPlaceholderText("昵称（注册用）")
 
-        btn_login = QtWidgets.QPushButton("登录")
-        btn_register = QtWidgets.QPushButton("注册")
+        self.btn_login = btn_login = QtWidgets.QPushButton("登录")
+        self.btn_register = btn_register = QtWidgets.QPushButton("注册")
         self.msg = QtWidgets.QLabel()
         if not SHOW_MSG:
             self.msg.hide()
@@ -96,30 +173,64 @@ class LoginWindow(QtWidgets.QWidget):
         btn_login.clicked.connect(self.on_login)
         btn_register.clicked.connect(self.on_register)
 
+    def _set_busy(self, busy: bool) -> None:
+        self.btn_login.setEnabled(not busy)
+        self.btn_register.setEnabled(not busy)
+
     def on_login(self) -> None:
-        try:
-            token = self.api.login(self.email.text(), self.password.text())
-            me = self.api.me()
-            self.logged_in.emit({"token": token, "me": me})
-        except Exception as e:  # noqa: BLE001
+        email, password = self.email.text(), self.password.text()
+
+        async def login() -> Dict[str, Any]:
+            token = await self.api.login(email, password)
+            # 登录后并发拉取个人信息与好友列表
+            me, friends = await asyncio.gather(
+                self.api.me(), self.api.friends_summary()
+            )
+            return {"token": token, "me": me, "friends": friends}
+
+        def on_ok(payload: Dict[str, Any]) -> None:
+            self._set_busy(False)
+            self.logged_in.emit(payload)
+
+        def on_err(e: Exception) -> None:
+            self._set_busy(False)
             flash_label(self.msg, f"登录失败: {friendly_error(e)}")
 
+        self._set_busy(True)
+        run_async(self, login(), on_ok, on_err)
+
     def on_register(self) -> None:
-        try:
-            self.api.register(
-                self.email.text(), self.password.text(), self.display_name.text()
-            )
+        def on_ok(_: Any) -> None:
+            self._set_busy(False)
             flash_label(self.msg, "注册成功，请登录")
-        except Exception as e:  # noqa: BLE001
+
+        def on_err(e: Exception) -> None:
+            self._set_busy(False)
             flash_label(self.msg, f"注册失败: {friendly_error(e)}")
 
+        self._set_busy(True)
+        run_async(
+            self,
+            self.api.register(
+                self.email.text(), self.password.text(), self.display_name.text()
+            ),
+            on_ok,
+            on_err,
+        )
+
 
 class FriendsWindow(QtWidgets.QWidget):
     open_chat = QtCore.pyqtSignal(dict)
 
-    def __init__(self, api: ApiClient):
+    def __init__(self, api: AsyncApiClient):
         super().__init__()
         self.api = api
+        self.me_id: Optional[int] = None
+        # 会话 id -> 未读数：刷新时取服务端的值，之后叠加 WS 推送的增量
+        self.unread: Dict[str, int] = {}
+        # 会话 id -> WSClient 上次报告的累计未读数，用于换算增量
+        self._live: Dict[str, int] = {}
+        self._items: Dict[str, QtWidgets.QListWidgetItem] = {}
         self.setWindowTitle("好友列表")
 
         self.list = QtWidgets.QListWidget()
@@ -164,25 +275,73 @@ class FriendsWindow(QtWidgets.QWidget):
         btn_refresh.clicked.connect(self.refresh)
         self.list.itemDoubleClicked.connect(self.on_open_chat)
 
-        self.refresh()
-
     def refresh(self) -> None:
-        try:
-            self.list.clear()
-            for f in self.api.friends():
-                item = QtWidgets.QListWidgetItem(f["display_name"])  # 仅显示昵称
-                item.setData(QtCore.Qt.ItemDataRole.UserRole, f)
-                self.list.addItem(item)
-        except Exception as e:  # noqa: BLE001
-            flash_label(self.msg, f"加载失败: {friendly_error(e)}")
+        run_async(
+            self,
+            self.api.friends_summary(),
+            self.set_friends,
+            lambda e: flash_label(self.msg, f"加载失败: {friendly_error(e)}"),
+        )
+
+    def set_friends(self, friends: list[Dict[str, Any]]) -> None:
+        # friends 为 /friends/summary 的结果：带最后一条消息与未读数
+        self.list.clear()
+        self._items.clear()
+        self.unread.clear()
+        for f in friends:
+            item = QtWidgets.QListWidgetItem()
+            item.setData(QtCore.Qt.ItemDataRole.UserRole, f)
+            if self.me_id is not None:
+                key = direct_key(self.me_id, f["id"])
+                self._items[key] = item
+                if f.get("unread"):
+                    self.unread[key] = f["unread"]
+            self._update_item(item)
+            self.list.addItem(item)
+
+    def _update_item(self, item: QtWidgets.QListWidgetItem) -> None:
+        f = item.data(QtCore.Qt.ItemDataRole.UserRole)
+        count = 0
+        if self.me_id is not None:
+            count = self.unread.get(direct_key(self.me_id, f["id"]), 0)
+        name = f["display_name"]
+        if count:
+            badge = f"{UNREAD_BADGE_MAX}+" if count > UNREAD_BADGE_MAX else str(count)
+            name = f"{name} ({badge})"
+        last = f.get("last_message")
+        preview = last["body"].replace("\n", " ")[:PREVIEW_CHARS] if last else ""
+        item.setText(f"{name}\n{preview}")
+
+    def add_live_unread(self, conversation: str, total: int) -> None:
+        # WSClient 报告的是订阅前累计的未读数：只叠加新增的部分
+        added = total - self._live.get(conversation, 0)
+        self._live[conversation] = total
+        if added <= 0:
+            return
+        self.unread[conversation] = self.unread.get(conversation, 0) + added
+        item = self._items.get(conversation)
+        if item is not None:
+            self._update_item(item)
+
+    def clear_unread(self, conversation: str) -> None:
+        # 打开聊天窗口时调用；WSClient 订阅时同时清零了该会话的累计数
+        self.unread.pop(conversation, None)
+        self._live[conversation] = 0
+        item = self._items.get(conversation)
+        if item is not None:
+            self._update_item(item)
 
     def on_add(self) -> None:
-        try:
-            f = self.api.add_friend(self.add_email.text())
+        def on_ok(f: Dict[str, Any]) -> None:
             flash_label(self.msg, f"已添加: {f['display_name']}")
             self.refresh()
-        except Exception as e:  # noqa: BLE001
-            flash_label(self.msg, f"添加失败: {friendly_error(e)}")
+
+        run_async(
+            self,
+            self.api.add_friend(self.add_email.text()),
+            on_ok,
+            lambda e: flash_label(self.msg, f"添加失败: {friendly_error(e)}"),
+        )
 
     def on_open_chat(self, item: QtWidgets.QListWidgetItem) -> None:  # type: ignore[name-defined]
         data = item.data(QtCore.Qt.ItemDataRole.UserRole)
@@ -190,36 +349,44 @@ class FriendsWindow(QtWidgets.QWidget):
 
 
 class ChatWindow(QtWidgets.QWidget):
-    message_received = QtCore.pyqtSignal(dict)
+    messages_received = QtCore.pyqtSignal(list)
+    # resync() 的重新加载完成后发出
+    resynced = QtCore.pyqtSignal()
 
     def __init__(
-        self, api: ApiClient, ws: WSClient, me: Dict[str, Any], peer: Dict[str, Any]
+        self,
+        api: AsyncApiClient,
+        ws: WSClient,
+        me: Dict[str, Any],
+        peer: Dict[str, Any],
+        cache: Optional[MessageCache] = None,
     ):
         super().__init__()
         self.api = api
         self.ws = ws
         self.me = me
         self.peer = peer
+        self.conversation = direct_key(me["id"], peer["id"])
+        self.cache = cache
         self.setWindowTitle(f"与 {peer['display_name']} 聊天")
         self.resize(900, 620)
         self.setMinimumSize(720, 520)
 
-        self.history = QtWidgets.QScrollArea()
-        self.history.setWidgetResizable(True)
-        self.scroll_body = QtWidgets.QWidget()
-        self.scroll_body.setObjectName("ChatArea")
-        self.messages_layout = QtWidgets.QVBoxLayout(self.scroll_body)
-        # 底部锚点用于自动滚动
-        self.bottom_anchor = QtWidgets.QWidget()
-        self.bottom_anchor.setFixedHeight(1)
-        self.messages_layout.addWidget(self.bottom_anchor)
-        self.history.setWidget(self.scroll_body)
+        # 虚拟化列表：只为可见行排版与绘制，长会话打开与滚动都不随消息数变慢
+        self.history = TranscriptView(me["id"])
+        self.transcript = self.history.transcript
         self.input = QtWidgets.QLineEdit()
         self.input.returnPressed.connect(self.on_send)
         btn_send = QtWidgets.QPushButton("发送")
+        self.msg = QtWidgets.QLabel()
+        if not SHOW_MSG:
+            self.msg.hide()
+        # 本窗口发出、尚未确认的 client_msg_id，用于认领 WSClient 报告的发送失败
+        self._sending: set[str] = set()
 
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.history)
+        layout.addWidget(self.msg)
         bottom = QtWidgets.QHBoxLayout()
         bottom.addWidget(self.input)
         bottom.addWidget(btn_send)
@@ -228,91 +395,296 @@ class ChatWindow(QtWidgets.QWidget):
 
         btn_send.clicked.connect(self.on_send)
 
-        # 主线程安全更新
-        self.message_received.connect(self.append_message)
-
-        # 内容变化后自动滚动到底部
+        # 主线程安全更新：每个 WS 帧只发一次信号，主线程缓冲后按帧率批量刷新
+        self._pending: list[Dict[str, Any]] = []
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(UI_FLUSH_INTERVAL_MS)
+        self._flush_timer.timeout.connect(self._flush_pending)
+        # 一批插入引起的多次 rangeChanged 合并为一次滚动
+        self._scroll_timer = QtCore.QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(0)
+        self._scroll_timer.timeout.connect(self.scroll_to_bottom)
+        self.messages_received.connect(self._on_live_messages)
+        # 本地缓存与服务端对齐（增量拉取完成）之前收到的实时消息，对齐后再写入缓存，避免缓存出现空洞
+        self._synced = False
+        self._unsynced_live: list[Dict[str, Any]] = []
+        self._read_up_to = 0
+        self._read_timer = QtCore.QTimer(self)
+        self._read_timer.setSingleShot(True)
+        self._read_timer.setInterval(MARK_READ_DELAY_MS)
+        self._read_timer.timeout.connect(self._report_read)
+
+        # 向上翻页加载更早消息时，保持视口相对底部的位置不变
+        self._older_cursor: Optional[int] = None
+        self._loading_older = False
+        self._resyncing = False
+        self._anchor: Optional[tuple[int, int]] = None  # (消息 id, 相对视口顶部偏移)
+        self._restoring = False
+
+        # 内容变化后自动滚动到底部（加载更早消息时保持原位置）
         try:
-            self.history.verticalScrollBar().rangeChanged.connect(
-                lambda _min, _max: self.scroll_to_bottom()
-            )
+            sb = self.history.verticalScrollBar()
+            sb.rangeChanged.connect(self._on_range_changed)
+            sb.valueChanged.connect(self._on_scrolled)
         except Exception:
             pass
 
-        # 加载历史
-        for m in self.api.history(self.peer["id"]):
-            self.append_message(m)
-
-        # 订阅 WS 收到的消息（同时处理 sent 与 recv）
-        def on_recv(data: Dict[str, Any]) -> None:
-            if data.get("type") in ("recv", "sent"):
-                m = data.get("message")
-                if m and (
-                    (
-                        m["sender_id"] == self.peer["id"]
-                        and m["receiver_id"] == self.me["id"]
-                    )
-                    or (
-                        m["sender_id"] == self.me["id"]
-                        and m["receiver_id"] == self.peer["id"]
-                    )
-                ):
-                    self.message_received.emit(m)
-
-        self.ws.on_received = on_recv
-
-    def append_message(self, m: Dict[str, Any]) -> None:
-        me_side = m["sender_id"] == self.me["id"]
-        bubble = QtWidgets.QFrame()
-        bubble.setObjectName("BubbleMe" if me_side else "BubblePeer")
-        text = QtWidgets.QLabel(m["body"])
-        text.setWordWrap(True)
-        bl = QtWidgets.QHBoxLayout(bubble)
-        bl.setContentsMargins(10, 8, 10, 8)
-        bl.addWidget(text)
-
-        row = QtWidgets.QHBoxLayout()
-        row.setContentsMargins(0, 0, 0, 0)
-        if me_side:
-            row.addStretch(1)
-            row.addWidget(bubble, 0)
+        # 优先从本地缓存立即显示最近一页，再只向服务端拉取缓存之后的增量；
+        # 没有缓存时只加载最新一页（异步，不阻塞窗口打开）。更早的消息在滚动到顶部时再按需加载
+        cached: list[Dict[str, Any]] = []
+        if self.cache is not None:
+            self.cache.touch(self.conversation)
+            cached = self.cache.latest(self.conversation, HISTORY_PAGE_SIZE)
+        if cached:
+            self.queue_messages(cached)
+            self._older_cursor = self._cached_cursor(cached)
+            run_async(
+                self, self._fetch_delta(cached[0]["id"]), self._on_delta, lambda _e: None
+            )
         else:
-            row.addWidget(bubble, 0)
-            row.addStretch(1)
+            self._load_first_page()
 
-        # 插入到锚点之前并滚动到底部
-        idx = self.messages_layout.indexOf(self.bottom_anchor)
-        if idx == -1:
-            idx = self.messages_layout.count()
-        self.messages_layout.insertLayout(idx, row)
-        QtCore.QTimer.singleShot(0, self.scroll_to_bottom)
+        # 按会话 id 订阅 WS 消息（sent、recv 与重连后的 sync 补发）；弱引用，窗口释放后自动退订。
+        # 订阅表由 asyncio 线程维护，交给事件循环执行
+        AsyncioRunner.instance().call_soon(
+            self.ws.subscribe, direct_key(me["id"], peer["id"]), self._on_ws_messages
+        )
+
+    def _on_ws_messages(self, messages: list[Dict[str, Any]]) -> None:
+        # 在 asyncio 线程中调用：经信号转到主线程
+        self.messages_received.emit(messages)
+
+    def _on_live_messages(self, messages: list[Dict[str, Any]]) -> None:
+        for m in messages:
+            self._sending.discard(m.get("client_msg_id"))
+        if self.cache is not None:
+            if self._synced:
+                self.cache.add(self.conversation, messages)
+            else:
+                self._unsynced_live.extend(messages)
+        self.queue_messages(messages)
+
+    def _mark_synced(self) -> None:
+        self._synced = True
+        if self.cache is not None and self._unsynced_live:
+            self.cache.add(self.conversation, self._unsynced_live)
+        self._unsynced_live.clear()
+
+    def _cached_cursor(self, items: list[Dict[str, Any]]) -> Optional[int]:
+        # 本地还有更早的缓存，或服务端还有更早的消息时，才可继续向上翻页
+        assert self.cache is not None
+        if len(items) >= HISTORY_PAGE_SIZE or self.cache.has_older(self.conversation):
+            return items[-1]["id"]
+        return None
+
+    async def _fetch_delta(self, after_id: int) -> Optional[list[Dict[str, Any]]]:
+        # 在 asyncio 线程中执行：按 after_id 向新方向翻页，直到追上最新消息
+        items: list[Dict[str, Any]] = []
+        cursor: Optional[int] = after_id
+        for _ in range(DELTA_MAX_PAGES):
+            page = await self.api.history(
+                self.peer["id"], after_id=cursor, limit=DELTA_PAGE_SIZE
+            )
+            items.extend(page["items"])
+            cursor = page.get("next_cursor")
+            if cursor is None:
+                return items
+        return None
+
+    def _on_delta(self, items: Optional[list[Dict[str, Any]]]) -> None:
+        assert self.cache is not None
+        if items is None:
+            # 离线期间消息太多：丢弃该会话的缓存，从最新一页重新开始
+            self.resync()
+            return
+        self.cache.add(self.conversation, items)
+        self._mark_synced()
+        self.queue_messages(items)
+
+    def resync(self) -> None:
+        # 本窗口的消息（及缓存）可能有空洞：丢弃后从最新一页重新加载，更早的消息按需翻页
+        if self.cache is not None:
+            self.cache.reset(self.conversation)
+        self._synced = False
+        self._unsynced_live.clear()
+        self._pending.clear()
+        self.transcript.clear()
+        self._older_cursor = None
+        self._resyncing = True
+        self._load_first_page()
+
+    def _load_first_page(self) -> None:
+        self._loading_older = True
+        run_async(
+            self,
+            self.api.history(self.peer["id"], limit=HISTORY_PAGE_SIZE),
+            self._on_first_page,
+            self._on_first_page_failed,
+        )
+
+    def _on_first_page_failed(self, _e: Exception) -> None:
+        self._loading_older = False
+        if self._resyncing:
+            # 重新加载完成前 ack 保持暂停，失败时持续重试
+            QtCore.QTimer.singleShot(RESYNC_RETRY_MS, self._load_first_page)
+
+    def queue_messages(self, items: list[Dict[str, Any]]) -> None:
+        self._pending.extend(items)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _flush_pending(self) -> None:
+        # 一次 beginInsertRows/布局/滚动处理一整批；积压过多时分帧处理，窗口保持响应
+        batch = self._pending[:UI_FLUSH_MAX]
+        del self._pending[:UI_FLUSH_MAX]
+        self.transcript.add_messages(batch)
+        self._note_read(batch)
+        if self._pending:
+            self._flush_timer.start()
+
+    def _note_read(self, batch: list[Dict[str, Any]]) -> None:
+        # 窗口中显示过的对方消息视为已读；合并后延迟上报，不为每条消息发请求
+        up_to = max(
+            (m["id"] for m in batch if m["sender_id"] == self.peer["id"]), default=0
+        )
+        if up_to > self._read_up_to:
+            self._read_up_to = up_to
+            if not self._read_timer.isActive():
+                self._read_timer.start()
+
+    def _report_read(self) -> None:
+        run_async(
+            self,
+            self.api.mark_read(self.peer["id"], self._read_up_to),
+            lambda _: None,
+            lambda _e: None,
+        )
+
+    def prepend_messages(self, items: list[Dict[str, Any]]) -> None:
+        # 记下当前顶部可见的消息及其偏移，布局完成后据此恢复视口位置
+        top = self.history.indexAt(QtCore.QPoint(0, 0))
+        if top.isValid():
+            anchor_id = top.data(MessageRole)["id"]
+            self._anchor = (anchor_id, self.history.visualRect(top).top())
+        self.transcript.add_messages(items)
+
+    def _on_range_changed(self, _min: int, _max: int) -> None:
+        # 分批布局会多次触发 rangeChanged，锚点保留到用户下一次滚动
+        if self._anchor is not None:
+            row = self.transcript.row_of(self._anchor[0])
+            if row is not None:
+                rect = self.history.visualRect(self.transcript.index(row))
+                sb = self.history.verticalScrollBar()
+                self._restoring = True
+                sb.setValue(sb.value() + rect.top() - self._anchor[1])
+                self._restoring = False
+                return
+        self._scroll_timer.start()
+
+    def _on_scrolled(self, value: int) -> None:
+        if not self._restoring:
+            self._anchor = None
+        sb = self.history.verticalScrollBar()
+        if value == sb.minimum() and sb.maximum() > sb.minimum():
+            self.load_older()
+
+    def _on_first_page(self, page: Dict[str, Any]) -> None:
+        self._loading_older = False
+        self._older_cursor = page.get("next_cursor")
+        if self.cache is not None:
+            self.cache.add(self.conversation, page["items"])
+            self.cache.set_has_older(self.conversation, self._older_cursor is not None)
+            self._mark_synced()
+        self.queue_messages(page["items"])
+        if self._resyncing:
+            self._resyncing = False
+            self.resynced.emit()
+
+    def load_older(self) -> None:
+        if self._older_cursor is None or self._loading_older:
+            return
+        if self.cache is not None:
+            # 先翻本地缓存，缓存翻完且服务端还有更早的消息时才请求网络
+            items = self.cache.before(
+                self.conversation, self._older_cursor, HISTORY_PAGE_SIZE
+            )
+            if items:
+                self._older_cursor = self._cached_cursor(items)
+                self.prepend_messages(items)
+                return
+        self._loading_older = True
+
+        def on_ok(page: Dict[str, Any]) -> None:
+            self._loading_older = False
+            self._older_cursor = page.get("next_cursor")
+            if self.cache is not None:
+                self.cache.add(self.conversation, page["items"])
+                self.cache.set_has_older(
+                    self.conversation, self._older_cursor is not None
+                )
+            if page["items"]:
+                self.prepend_messages(page["items"])
+
+        run_async(
+            self,
+            self.api.history(
+                self.peer["id"], before_id=self._older_cursor, limit=HISTORY_PAGE_SIZE
+            ),
+            on_ok,
+            lambda _e: setattr(self, "_loading_older", False),
+        )
 
     def scroll_to_bottom(self) -> None:
-        try:
-            # 优先确保锚点可见
-            self.history.ensureWidgetVisible(self.bottom_anchor, 0, 0)
-        except Exception:
-            pass
-        try:
-            # 同时设置滚动条到最大，双保险
-            sb = self.history.verticalScrollBar()
-            sb.setValue(sb.maximum())
-        except Exception:
-            pass
+        self.history.scrollToBottom()
 
     def on_send(self) -> None:
         body = self.input.text()
         self.input.clear()
-        AsyncioRunner.instance().create_task(
-            self.ws.send_message(self.peer["id"], body)
+        client_msg_id = uuid.uuid4().hex
+        self._sending.add(client_msg_id)
+
+        def on_err(e: Exception) -> None:
+            # 未能进入发送缓冲：放回输入框，避免丢失
+            self._sending.discard(client_msg_id)
+            if not self.input.text():
+                self.input.setText(body)
+            flash_label(self.msg, f"发送失败: {friendly_error(e)}")
+
+        run_async(
+            self,
+            self.ws.send_message(self.peer["id"], body, client_msg_id),
+            lambda _id: None,
+            on_err,
         )
 
+    def send_failed(self, client_msg_id: str, detail: str, will_retry: bool) -> None:
+        if client_msg_id not in self._sending:
+            return
+        reason = friendly_error(RuntimeError(detail))
+        if will_retry:
+            flash_label(self.msg, f"发送失败，正在重试: {reason}")
+        else:
+            self._sending.discard(client_msg_id)
+            flash_label(self.msg, f"发送失败: {reason}")
+
 
 class MainApp(QtWidgets.QStackedWidget):
+    unread_changed = QtCore.pyqtSignal(str, int)
+    sync_truncated = QtCore.pyqtSignal()
+    send_failed = QtCore.pyqtSignal(str, str, bool)
+    auth_failed = QtCore.pyqtSignal(list)
+
     def __init__(self, api_base: str, ws_url: str):
         super().__init__()
-        self.api = ApiClient(api_base)
+        self.api = AsyncApiClient(api_base)
         self.ws = WSClient(ws_url)
+        # 打开的聊天窗口（WSClient 只弱引用订阅者，由这里持有），同一好友只开一个
+        self.chats: Dict[int, ChatWindow] = {}
+        self.cache: Optional[MessageCache] = None
+        # 补发截断后尚未重新加载完成的聊天窗口（好友 id）；全部完成后才恢复 ack
+        self._resync_pending: set[int] = set()
 
         self.login = LoginWindow(self.api)
         self.friends = FriendsWindow(self.api)
@@ -322,6 +694,15 @@ class MainApp(QtWidgets.QStackedWidget):
 
         self.login.logged_in.connect(self.on_logged_in)
         self.friends.open_chat.connect(self.on_open_chat)
+        # on_unread 在 asyncio 线程中调用，经信号转到主线程更新好友列表
+        self.unread_changed.connect(self.friends.add_live_unread)
+        self.ws.on_unread = self.unread_changed.emit
+        self.sync_truncated.connect(self._on_sync_truncated)
+        self.ws.on_truncated = self.sync_truncated.emit
+        self.send_failed.connect(self._on_send_failed)
+        self.ws.on_send_failed = self.send_failed.emit
+        self.auth_failed.connect(self._on_auth_failed)
+        self.ws.on_auth_failed = self.auth_failed.emit
 
     def on_logged_in(self, payload: Dict[str, Any]) -> None:
         token = payload["token"]
@@ -330,12 +711,63 @@ class MainApp(QtWidgets.QStackedWidget):
         AsyncioRunner.instance().create_task(self.ws.connect())
         self.setCurrentWidget(self.friends)
         self.me = me  # type: ignore[attr-defined]
-        # 登录后自动刷新好友列表
-        try:
-            self.friends.refresh()
-        except Exception:
-            pass
+        self.friends.me_id = me["id"]
+        if self.cache is not None:
+            self.cache.close()
+        self.cache = MessageCache.for_user(self.api.base_url, me["id"])
+        # 好友列表已在登录时并发拉取
+        self.friends.set_friends(payload["friends"])
+
+    def _on_auth_failed(self, pending: list[str]) -> None:
+        # 登录已过期：WSClient 已停止重连并清空发送缓冲，关闭聊天窗口后回到登录页
+        for w in list(self.chats.values()):
+            w.close()
+        self.api.set_token(None)
+        self.setCurrentWidget(self.login)
+        text = "登录已过期，请重新登录"
+        if pending:
+            text += f"（{len(pending)} 条消息未发送）"
+        flash_label(self.login.msg, text)
+
+    def _on_sync_truncated(self) -> None:
+        # 重连补发不完整：打开的窗口改用历史接口重新加载，好友列表重新拉取未读数；
+        # 未打开的会话在打开时按缓存位置增量拉取，不受影响。窗口全部重新加载完成后再恢复 ack
+        self._resync_pending = set(self.chats)
+        for w in list(self.chats.values()):
+            w.resync()
+        self.friends.refresh()
+        if not self._resync_pending:
+            AsyncioRunner.instance().create_task(self.ws.release_acks())
+
+    def _on_chat_resynced(self, peer_id: int) -> None:
+        # 重新加载完成，或窗口已关闭（缓存已清空，下次打开时重新加载最新一页）
+        if peer_id not in self._resync_pending:
+            return
+        self._resync_pending.discard(peer_id)
+        if not self._resync_pending:
+            AsyncioRunner.instance().create_task(self.ws.release_acks())
+
+    def _on_send_failed(self, client_msg_id: str, detail: str, will_retry: bool) -> None:
+        # 由发出该消息的窗口认领并提示
+        for w in list(self.chats.values()):
+            w.send_failed(client_msg_id, detail, will_retry)
 
     def on_open_chat(self, peer: Dict[str, Any]) -> None:
-        w = ChatWindow(self.api, self.ws, self.me, peer)  # type: ignore[attr-defined]
+        w = self.chats.get(peer["id"])
+        if w is None:
+            w = ChatWindow(self.api, self.ws, self.me, peer, self.cache)  # type: ignore[attr-defined]
+            if self.cache is not None:
+                # 超出本地缓存容量时淘汰最久未打开的会话（已打开的窗口除外）
+                keep = [c.conversation for c in self.chats.values()]
+                self.cache.evict(keep=keep + [w.conversation])
+            w.setAttribute(QtCore.Qt.WidgetAttribute.WA_DeleteOnClose)
+            w.destroyed.connect(lambda _=None, pid=peer["id"]: self.chats.pop(pid, None))
+            w.destroyed.connect(
+                lambda _=None, pid=peer["id"]: self._on_chat_resynced(pid)
+            )
+            w.resynced.connect(lambda pid=peer["id"]: self._on_chat_resynced(pid))
+            self.chats[peer["id"]] = w
+            self.friends.clear_unread(w.conversation)
         w.show()
+        w.raise_()
+        w.activateWindow()
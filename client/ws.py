@@ -1,41 +1,385 @@
 import asyncio
 import json
-from typing import Any, Callable, Dict, Optional
+import random
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
 
 import websockets
 
 
+# 去重时记住的最近消息 id 数
+SEEN_IDS_MAX = 10000
+# ack 合并：最多延迟这么久，或累计这么多条消息后立即发送
+ACK_DELAY = 0.5
+ACK_BATCH = 50
+# 断线重连：全抖动指数退避（0 ~ min(上限, 基数 * 2^n) 之间随机），避免大量客户端同时重连
+RECONNECT_BASE = 0.5
+RECONNECT_CAP = 30.0
+# 未收到 sent 确认的消息最多缓存条数，重连后按顺序重发
+OUTBOX_MAX = 500
+# 服务端报告可重试的发送失败时：等待这么久后重发，最多重试这么多次
+SEND_RETRY_DELAY = 2.0
+SEND_RETRY_MAX = 3
+# 服务端鉴权失败的关闭码，不再重试
+CLOSE_UNAUTHORIZED = 4401
+
+MessagesCallback = Callable[[List[Dict[str, Any]]], None]
+CallbackRef = Callable[[], Optional[MessagesCallback]]
+
+
+def direct_key(a: int, b: int) -> str:
+    """单聊会话 id，与服务端 conversation_key 格式一致。"""
+    lo, hi = (a, b) if a <= b else (b, a)
+    return f"d:{lo}:{hi}"
+
+
+def room_key(room_id: int) -> str:
+    """群聊会话 id，与服务端 room_key 格式一致。"""
+    return f"g:{room_id}"
+
+
+def _weak_callback(callback: MessagesCallback) -> CallbackRef:
+    # 绑定方法只弱引用其所属对象，窗口关闭释放后订阅自动失效；普通函数强引用
+    if hasattr(callback, "__self__"):
+        return weakref.WeakMethod(callback)  # type: ignore[arg-type]
+    return lambda: callback
+
+
 class WSClient:
     def __init__(self, ws_url: str) -> None:
         self.ws_url = ws_url
         self.token: Optional[str] = None
         self._conn: Optional[websockets.WebSocketClientProtocol] = None
-        self._recv_task: Optional[asyncio.Task] = None
-        self.on_received: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._ready = False
+        self._closing = False
+        self.user_id: Optional[int] = None
+        # 会话 id -> 订阅者（弱引用）；按会话 id 直接查表分发，与打开的窗口数无关
+        self._subscribers: Dict[str, List[CallbackRef]] = {}
+        # 没有订阅者的会话：累计未读数，变化时通知 on_unread(会话 id, 未读数)
+        self.unread: Dict[str, int] = {}
+        self.on_unread: Optional[Callable[[str, int], None]] = None
+        # 每次（重新）鉴权成功并重发完缓冲后调用
+        self.on_ready: Optional[Callable[[], None]] = None
+        # 重连补发被服务端截断（离线期间消息过多）时调用：上层应改用历史接口重新加载，
+        # 完成后调用 release_acks()；在此之前 ack 不超过补发到的位置，缺失的消息不会被跳过
+        self.on_truncated: Optional[Callable[[], None]] = None
+        self._ack_ceiling: Optional[int] = None
+        # 按消息 id 去重：重连补发与重发确认可能带来重复帧
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._ack_up_to = 0
+        self._acked = 0
+        self._unacked = 0
+        self._ack_handle: Optional[asyncio.TimerHandle] = None
+        # client_msg_id -> send 帧；收到对应的 sent 或永久失败的错误后移除
+        self._outbox: "OrderedDict[str, str]" = OrderedDict()
+        self._retries: Dict[str, int] = {}
+        # 发送失败时调用 on_send_failed(client_msg_id, 错误说明, 是否会自动重试)
+        self.on_send_failed: Optional[Callable[[str, str, bool], None]] = None
+        # 服务端拒绝 token（如已过期）时调用 on_auth_failed(未能发出的 client_msg_id 列表)；
+        # 此后不再重连，须重新登录后再 connect()
+        self.on_auth_failed: Optional[Callable[[List[str]], None]] = None
 
     def set_token(self, token: str) -> None:
         self.token = token
 
     async def connect(self) -> None:
-        self._conn = await websockets.connect(self.ws_url)
+        # 启动重连监督任务；断线后用保存的 token 自动重连并重新鉴权
         assert self.token
-        await self._conn.send(json.dumps({"type": "auth", "token": self.token}))
-        if self._recv_task is None:
-            self._recv_task = asyncio.create_task(self._recv_loop())
+        self._closing = False
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.create_task(self._supervise())
 
-    async def _recv_loop(self) -> None:
-        assert self._conn
+    async def close(self) -> None:
+        self._closing = True
+        conn = self._conn
+        if conn is not None:
+            await conn.close()
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return random.uniform(0, min(RECONNECT_CAP, RECONNECT_BASE * 2**attempt))
+
+    async def _supervise(self) -> None:
+        attempt = 0
+        while not self._closing:
+            try:
+                conn = await websockets.connect(self.ws_url)
+            except Exception:  # noqa: BLE001
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            try:
+                self._conn = conn
+                await conn.send(json.dumps({"type": "auth", "token": self.token}))
+                await self._recv_loop(conn)
+            except Exception:  # noqa: BLE001
+                pass
+            finally:
+                if self._ready:
+                    attempt = 0
+                self._conn = None
+                self._ready = False
+            if conn.close_code == CLOSE_UNAUTHORIZED:
+                # token 失效：重试无意义。缓冲中的消息无法再发出，交给上层提示
+                self._on_auth_failed()
+                break
+            if self._closing:
+                break
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _on_auth_failed(self) -> None:
+        pending = list(self._outbox)
+        self._outbox.clear()
+        self._retries.clear()
+        if self.on_auth_failed:
+            self.on_auth_failed(pending)
+
+    async def _recv_loop(self, conn: websockets.WebSocketClientProtocol) -> None:
+        async for message in conn:
+            data = json.loads(message)
+            kind = data.get("type")
+            if kind == "ready":
+                self.user_id = data.get("user_id")
+                await self._replay_outbox(conn)
+                self._ready = True
+                if self.on_ready:
+                    self.on_ready()
+            elif kind == "ping":
+                # 应用层心跳
+                await conn.send('{"type":"pong"}')
+                continue
+            elif kind == "sent" and data.get("message"):
+                client_msg_id = data["message"].get("client_msg_id")
+                self._outbox.pop(client_msg_id, None)
+                self._retries.pop(client_msg_id, None)
+            elif kind == "error" and data.get("client_msg_id") is not None:
+                self._on_send_error(data)
+                continue
+            ids = self._message_ids(data)
+            data = self._drop_seen(data)
+            if data is not None and ids:
+                self._dispatch(data)
+            if kind == "sync" and data.get("truncated"):
+                self._on_sync_truncated(max(ids, default=self._ack_up_to))
+            # 交给上层之后再确认
+            if ids:
+                self._note_delivered(max(ids), len(ids))
+
+    def _on_send_error(self, data: Dict[str, Any]) -> None:
+        client_msg_id = str(data["client_msg_id"])
+        if client_msg_id not in self._outbox:
+            return
+        attempts = self._retries.get(client_msg_id, 0) + 1
+        retry = bool(data.get("retryable")) and attempts <= SEND_RETRY_MAX
+        if retry:
+            self._retries[client_msg_id] = attempts
+            asyncio.get_running_loop().call_later(
+                SEND_RETRY_DELAY, self._retry_send, client_msg_id
+            )
+        else:
+            # 永久失败（或重试次数用尽）：重发不会成功，移出缓冲，重连后也不再重发
+            self._outbox.pop(client_msg_id, None)
+            self._retries.pop(client_msg_id, None)
+        if self.on_send_failed:
+            self.on_send_failed(client_msg_id, str(data.get("detail", "")), retry)
+
+    def _retry_send(self, client_msg_id: str) -> None:
+        # 未连接时留在缓冲中，由重连后的重发处理
+        frame = self._outbox.get(client_msg_id)
+        conn = self._conn
+        if frame is not None and conn is not None and self._ready:
+            asyncio.get_running_loop().create_task(self._resend(conn, frame))
+
+    @staticmethod
+    async def _resend(conn: websockets.WebSocketClientProtocol, frame: str) -> None:
         try:
-            async for message in self._conn:
-                data = json.loads(message)
-                if self.on_received:
-                    self.on_received(data)
-        finally:
-            self._conn = None
-
-    async def send_message(self, to_user_id: int, body: str) -> None:
-        if not self._conn:
+            await conn.send(frame)
+        except Exception:  # noqa: BLE001
+            pass
+
+    def _on_sync_truncated(self, synced_up_to: int) -> None:
+        # 补发之后的实时消息 id 越过了未补发的空洞：暂停推进 ack，直到上层重新加载完成
+        if self._ack_ceiling is None:
+            self._ack_ceiling = synced_up_to
+        if self.on_truncated:
+            self.on_truncated()
+
+    async def release_acks(self) -> None:
+        # 上层已通过历史接口重新加载，空洞中的消息不会再丢失，恢复正常 ack
+        self._ack_ceiling = None
+        await self._send_ack()
+
+    # 订阅表与未读数只在事件循环线程中读写（分发也在该线程）；Qt 线程经 AsyncioRunner.call_soon 调用
+    def subscribe(self, conversation: str, callback: MessagesCallback) -> None:
+        self._subscribers.setdefault(conversation, []).append(_weak_callback(callback))
+        self.unread.pop(conversation, None)
+
+    def unsubscribe(self, conversation: str, callback: MessagesCallback) -> None:
+        refs = [r for r in self._subscribers.get(conversation, []) if r() != callback]
+        if refs:
+            self._subscribers[conversation] = refs
+        else:
+            self._subscribers.pop(conversation, None)
+
+    def conversation_of(self, message: Dict[str, Any]) -> str:
+        if message.get("room_id") is not None:
+            return room_key(message["room_id"])
+        return direct_key(message["sender_id"], message["receiver_id"])
+
+    def _dispatch(self, data: Dict[str, Any]) -> None:
+        # recv/sent 为单条、sync 为一批：按会话分组后每个订阅者每帧只回调一次
+        if data.get("type") == "sync":
+            messages = data.get("messages", [])
+        else:
+            messages = [data["message"]]
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for m in messages:
+            groups.setdefault(self.conversation_of(m), []).append(m)
+        for conversation, batch in groups.items():
+            callbacks = self._live_subscribers(conversation)
+            if callbacks:
+                for callback in callbacks:
+                    try:
+                        callback(batch)
+                    except Exception:  # noqa: BLE001
+                        # 单个订阅者出错不影响其他会话的分发
+                        pass
+                continue
+            incoming = sum(1 for m in batch if m["sender_id"] != self.user_id)
+            if incoming:
+                count = self.unread.get(conversation, 0) + incoming
+                self.unread[conversation] = count
+                if self.on_unread:
+                    self.on_unread(conversation, count)
+
+    def _live_subscribers(self, conversation: str) -> List[MessagesCallback]:
+        refs = self._subscribers.get(conversation)
+        if not refs:
+            return []
+        callbacks = [cb for cb in (r() for r in refs) if cb is not None]
+        if len(callbacks) != len(refs):
+            # 清理已释放窗口留下的失效引用
+            alive = [r for r in refs if r() is not None]
+            if alive:
+                self._subscribers[conversation] = alive
+            else:
+                del self._subscribers[conversation]
+        return callbacks
+
+    async def _replay_outbox(self, conn: websockets.WebSocketClientProtocol) -> None:
+        # 断线期间输入、以及已发出但未确认的消息：服务端按幂等键去重，重发是安全的。
+        # 重发过程中新加入缓冲的消息也一并按顺序发出，之后才标记为就绪。
+        replayed: set[str] = set()
+        while True:
+            pending = [
+                (key, frame)
+                for key, frame in self._outbox.items()
+                if key not in replayed
+            ]
+            if not pending:
+                return
+            for key, frame in pending:
+                await conn.send(frame)
+                replayed.add(key)
+
+    @staticmethod
+    def _message_ids(data: Dict[str, Any]) -> List[int]:
+        kind = data.get("type")
+        if kind in ("recv", "sent") and data.get("message"):
+            return [data["message"]["id"]]
+        if kind == "sync":
+            return [m["id"] for m in data.get("messages", [])]
+        return []
+
+    def _is_new(self, message_id: int) -> bool:
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > SEEN_IDS_MAX:
+            self._seen.popitem(last=False)
+        return True
+
+    def _drop_seen(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        kind = data.get("type")
+        if kind in ("recv", "sent") and data.get("message"):
+            return data if self._is_new(data["message"]["id"]) else None
+        if kind == "sync":
+            return {
+                **data,
+                "messages": [
+                    m for m in data.get("messages", []) if self._is_new(m["id"])
+                ],
+            }
+        return data
+
+    def _note_delivered(self, message_id: int, count: int) -> None:
+        if message_id > self._ack_up_to:
+            self._ack_up_to = message_id
+        self._unacked += count
+        loop = asyncio.get_running_loop()
+        if self._unacked >= ACK_BATCH:
+            if self._ack_handle is not None:
+                self._ack_handle.cancel()
+            self._ack_handle = None
+            loop.create_task(self._send_ack())
+        elif self._ack_handle is None:
+            self._ack_handle = loop.call_later(ACK_DELAY, self._ack_later)
+
+    def _ack_later(self) -> None:
+        self._ack_handle = None
+        asyncio.get_running_loop().create_task(self._send_ack())
+
+    async def _send_ack(self) -> None:
+        up_to = self._ack_up_to
+        if self._ack_ceiling is not None:
+            up_to = min(up_to, self._ack_ceiling)
+        if not self._conn or up_to <= self._acked:
+            return
+        self._unacked = 0
+        await self._conn.send(json.dumps({"type": "ack", "up_to": up_to}))
+        self._acked = max(self._acked, up_to)
+
+    async def send_message(
+        self, to_user_id: int, body: str, client_msg_id: Optional[str] = None
+    ) -> str:
+        return await self._send({"to_user_id": to_user_id}, body, client_msg_id)
+
+    async def send_room_message(
+        self, room_id: int, body: str, client_msg_id: Optional[str] = None
+    ) -> str:
+        return await self._send({"room_id": room_id}, body, client_msg_id)
+
+    async def _send(
+        self, target: Dict[str, Any], body: str, client_msg_id: Optional[str]
+    ) -> str:
+        # client_msg_id 为幂等键：同一条消息重发时沿用，服务端不会重复落库。
+        # 未连接时先放入发送缓冲，重连鉴权成功后自动重发；重连监督已停止（鉴权失败或已关闭）时不再缓冲。
+        if self._supervisor is None or self._supervisor.done():
             raise RuntimeError("WebSocket not connected")
-        await self._conn.send(
-            json.dumps({"type": "send", "to_user_id": to_user_id, "body": body})
+        client_msg_id = client_msg_id or uuid.uuid4().hex
+        if client_msg_id not in self._outbox and len(self._outbox) >= OUTBOX_MAX:
+            raise RuntimeError("WebSocket send buffer full")
+        frame = json.dumps(
+            {
+                "type": "send",
+                **target,
+                "body": body,
+                "client_msg_id": client_msg_id,
+            }
         )
+        self._outbox[client_msg_id] = frame
+        conn = self._conn
+        if conn is not None and self._ready:
+            try:
+                await conn.send(frame)
+            except Exception:  # noqa: BLE001
+                # 连接已断开，留在缓冲中等待重连后重发
+                pass
+        return client_msg_id
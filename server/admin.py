@@ -0,0 +1,71 @@
+import hmac
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from .config import settings
+from .profiling import profiler, slow_requests
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    # 未配置 ADMIN_TOKEN 时诊断接口视为不存在
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(
+        x_admin_token.encode("utf-8"), settings.admin_token.encode("utf-8")
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)], include_in_schema=False)
+
+
+@router.get("/profiler")
+def profiler_status() -> Dict[str, Any]:
+    return profiler.status()
+
+
+@router.post("/profiler/start")
+def start_profiler(
+    interval_ms: float = Query(default=None, ge=1, le=1000),
+    seconds: float = Query(default=None, gt=0, le=3600),
+) -> Dict[str, Any]:
+    try:
+        profiler.start(
+            (interval_ms or settings.profiler_interval_ms) / 1000,
+            seconds or settings.profiler_max_seconds,
+        )
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="profiler already running")
+    return profiler.status()
+
+
+@router.post("/profiler/stop")
+def stop_profiler() -> Dict[str, Any]:
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profiler/collapsed", response_class=PlainTextResponse)
+def profiler_collapsed() -> str:
+    # 折叠栈：每行 "线程名;外层帧;...;内层帧 采样次数"，可直接交给 flamegraph.pl 或 speedscope
+    return profiler.collapsed()
+
+
+@router.get("/slow")
+def slow_entries() -> Dict[str, Any]:
+    entries: List[Dict[str, Any]] = slow_requests.entries()
+    return {"threshold_ms": slow_requests.threshold * 1000, "entries": entries}
+
+
+@router.put("/slow")
+def set_slow_threshold(threshold_ms: float = Query(ge=0)) -> Dict[str, Any]:
+    # 0 为关闭；修改立即生效，无需重启
+    slow_requests.set_threshold(threshold_ms / 1000)
+    return {"threshold_ms": threshold_ms}
+
+
+@router.delete("/slow", status_code=status.HTTP_204_NO_CONTENT)
+def clear_slow_entries() -> None:
+    slow_requests.clear()
@@ -1,18 +1,38 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import and_, or_, select
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import Select, and_, delete, func, literal, select, true
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from .config import settings
+from .db import SessionLocal, run_db
 from .deps import get_current_user, get_db
-from .models import Friendship, Message, User
+from .models import (
+    Conversation,
+    ConversationMember,
+    Friendship,
+    Message,
+    ReadMarker,
+    User,
+    conversation_key,
+    room_key,
+)
+from .rooms import rooms
 from .schemas import (
     AddFriendRequest,
+    AddRoomMemberRequest,
     AuthToken,
+    CreateRoomRequest,
     FriendOut,
+    FriendSummaryOut,
     LoginRequest,
+    MarkReadRequest,
     MessageOut,
+    MessagePage,
     RegisterRequest,
+    RoomOut,
     SendMessageRequest,
     UserOut,
 )
@@ -22,32 +42,48 @@ from .security import create_access_token, hash_password, verify_password
 router = APIRouter()
 
 
+def _user_by_email(email: str) -> Optional[User]:
+    with SessionLocal() as db:
+        return db.execute(select(User).where(User.email == email)).scalar_one_or_none()
+
+
+def _create_user(email: str, password_hash: str, display_name: str) -> Optional[User]:
+    # 并发注册同一邮箱时唯一约束冲突，返回 None
+    with SessionLocal() as db:
+        user = User(email=email, password_hash=password_hash, display_name=display_name)
+        db.add(user)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        db.refresh(user)
+        return user
+
+
+# 注册与登录为异步端点：查库在 DB 线程池中完成并立即归还连接，pbkdf2 在进程池中计算时
+# 只 await，不占用 Starlette 线程池，也不持有数据库连接
 @router.post("/auth/register", response_model=UserOut)
-def register(payload: RegisterRequest, db: Session = Depends(get_db)):
-    exists = db.execute(
-        select(User).where(User.email == payload.email)
-    ).scalar_one_or_none()
-    if exists:
+async def register(payload: RegisterRequest):
+    if await run_db(_user_by_email, payload.email) is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="该邮箱已注册"
         )
-    user = User(
-        email=payload.email,
-        password_hash=hash_password(payload.password),
-        display_name=payload.display_name,
+    password_hash = await hash_password(payload.password)
+    user = await run_db(
+        _create_user, payload.email, password_hash, payload.display_name
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="该邮箱已注册"
+        )
     return user
 
 
 @router.post("/auth/login", response_model=AuthToken)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = db.execute(
-        select(User).where(User.email == payload.email)
-    ).scalar_one_or_none()
-    if not user or not verify_password(payload.password, user.password_hash):
+async def login(payload: LoginRequest):
+    user = await run_db(_user_by_email, payload.email)
+    if not user or not await verify_password(payload.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="邮箱或密码错误"
         )
@@ -99,20 +135,297 @@ def list_friends(db: Session = Depends(get_db), user: User = Depends(get_current
     ]
 
 
-@router.get("/messages/{friend_id}", response_model=List[MessageOut])
+def _friends_summary_stmt(user_id: int) -> Select:
+    # 一条查询返回所有好友及其最后一条消息与未读数，避免客户端逐个好友请求历史（N+1）。
+    # 每个好友两个 LATERAL 子查询都走 (conversation_key, id) 索引：
+    # 最后一条消息取索引末端 1 行；未读数只扫描已读水位之后、最多 cap + 1 行，
+    # 因此返回值最大为 cap + 1，客户端据此显示 “cap+”。
+    key = func.concat(
+        "d:",
+        func.least(literal(user_id), User.id),
+        ":",
+        func.greatest(literal(user_id), User.id),
+    )
+    cap = settings.unread_count_cap
+    last = (
+        select(
+            Message.id,
+            Message.sender_id,
+            Message.receiver_id,
+            Message.body,
+            Message.client_msg_id,
+            Message.created_at,
+        )
+        .where(Message.conversation_key == key)
+        .order_by(Message.id.desc())
+        .limit(1)
+        .lateral("last_message")
+    )
+    unread_ids = (
+        select(Message.id)
+        .where(
+            Message.conversation_key == key,
+            Message.sender_id == User.id,
+            Message.id > func.coalesce(ReadMarker.last_read_id, 0),
+        )
+        .limit(cap + 1)
+        .correlate(User, ReadMarker)
+        .subquery("unread_ids")
+    )
+    unread = select(func.count().label("n")).select_from(unread_ids).lateral("unread")
+    return (
+        select(
+            User.id,
+            User.email,
+            User.display_name,
+            last.c.id.label("last_id"),
+            last.c.sender_id,
+            last.c.receiver_id,
+            last.c.body,
+            last.c.client_msg_id,
+            last.c.created_at,
+            unread.c.n,
+        )
+        .join(Friendship, Friendship.friend_user_id == User.id)
+        .outerjoin(
+            ReadMarker,
+            and_(ReadMarker.user_id == user_id, ReadMarker.conversation_key == key),
+        )
+        .outerjoin(last, true())
+        .join(unread, true())
+        .where(Friendship.user_id == user_id)
+        .order_by(User.display_name)
+    )
+
+
+@router.get("/friends/summary", response_model=List[FriendSummaryOut])
+def friends_summary(
+    db: Session = Depends(get_db), user: User = Depends(get_current_user)
+):
+    rows = db.execute(_friends_summary_stmt(user.id)).all()
+    return [
+        FriendSummaryOut(
+            id=r.id,
+            email=r.email,
+            display_name=r.display_name,
+            last_message=(
+                MessageOut(
+                    id=r.last_id,
+                    sender_id=r.sender_id,
+                    receiver_id=r.receiver_id,
+                    body=r.body,
+                    client_msg_id=r.client_msg_id,
+                    created_at=r.created_at,
+                )
+                if r.last_id is not None
+                else None
+            ),
+            unread=r.n,
+        )
+        for r in rows
+    ]
+
+
+@router.post("/messages/{friend_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+def mark_read(
+    friend_id: int,
+    payload: MarkReadRequest,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    # 已读水位只前进不后退（多端并发上报时取最大值）
+    stmt = insert(ReadMarker).values(
+        user_id=user.id,
+        conversation_key=conversation_key(user.id, friend_id),
+        last_read_id=payload.up_to,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ReadMarker.user_id, ReadMarker.conversation_key],
+        set_={
+            "last_read_id": func.greatest(
+                ReadMarker.last_read_id, stmt.excluded.last_read_id
+            )
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def _history_page(
+    db: Session,
+    key: str,
+    before_id: Optional[int],
+    after_id: Optional[int],
+    limit: int,
+    room_id: Optional[int] = None,
+) -> MessagePage:
+    # 基于 id 的 keyset 分页：id 单调递增，避免 OFFSET 扫描与整段会话一次性返回
+    stmt = select(Message).where(Message.conversation_key == key)
+    if after_id is not None and before_id is None:
+        # 仅向新方向翻页：取紧接 after_id 之后的一页，页内仍按最新在前返回
+        rows = list(
+            db.execute(
+                stmt.where(Message.id > after_id).order_by(Message.id).limit(limit + 1)
+            ).scalars()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+    else:
+        if before_id is not None:
+            stmt = stmt.where(Message.id < before_id)
+        if after_id is not None:
+            stmt = stmt.where(Message.id > after_id)
+        rows = list(
+            db.execute(stmt.order_by(Message.id.desc()).limit(limit + 1)).scalars()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    items = [MessageOut.model_validate(r) for r in rows]
+    for item in items:
+        item.room_id = room_id
+    # 游标为本页在翻页方向上的最后一条：向旧翻页为最旧的一条，向新翻页为最新的一条
+    next_cursor = None
+    if has_more:
+        forward = after_id is not None and before_id is None
+        next_cursor = rows[0].id if forward else rows[-1].id
+    return MessagePage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/messages/{friend_id}", response_model=MessagePage)
 def history(
     friend_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    return _history_page(
+        db, conversation_key(user.id, friend_id), before_id, after_id, limit
+    )
+
+
+def _require_member(db: Session, room_id: int, user_id: int) -> None:
+    if db.get(ConversationMember, (room_id, user_id)) is None:
+        raise HTTPException(status_code=404, detail="未找到该群或不是群成员")
+
+
+def _member_count(db: Session, room_id: int) -> int:
+    return db.execute(
+        select(func.count())
+        .select_from(ConversationMember)
+        .where(ConversationMember.conversation_id == room_id)
+    ).scalar_one()
+
+
+@router.post("/rooms", response_model=RoomOut)
+def create_room(
+    payload: CreateRoomRequest,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
+    member_ids = set(payload.member_ids) | {user.id}
+    if len(member_ids) > settings.room_max_members:
+        raise HTTPException(status_code=400, detail="群成员数超过上限")
+    found = set(db.execute(select(User.id).where(User.id.in_(member_ids))).scalars())
+    if found != member_ids:
+        raise HTTPException(status_code=404, detail="未找到该用户")
+    room = Conversation(title=payload.title, created_by=user.id)
+    db.add(room)
+    db.flush()
+    db.execute(
+        insert(ConversationMember),
+        [{"conversation_id": room.id, "user_id": uid} for uid in member_ids],
+    )
+    db.commit()
+    # 新群通常马上有消息：直接写入成员缓存
+    rooms.set(room.id, frozenset(member_ids))
+    return RoomOut(id=room.id, title=room.title, member_count=len(member_ids))
+
+
+@router.get("/rooms", response_model=List[RoomOut])
+def list_rooms(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    # 只统计自己所在的群，代价与自己的群数及其成员数成正比，而不是整张成员表
+    mine = (
+        select(ConversationMember.conversation_id)
+        .where(ConversationMember.user_id == user.id)
+        .scalar_subquery()
+        .correlate(None)
+    )
+    counts = (
+        select(
+            ConversationMember.conversation_id,
+            func.count().label("member_count"),
+        )
+        .where(ConversationMember.conversation_id.in_(mine))
+        .group_by(ConversationMember.conversation_id)
+        .subquery()
+    )
     rows = db.execute(
-        select(Message)
-        .where(
-            or_(
-                and_(Message.sender_id == user.id, Message.receiver_id == friend_id),
-                and_(Message.sender_id == friend_id, Message.receiver_id == user.id),
-            )
+        select(Conversation.id, Conversation.title, counts.c.member_count)
+        .join(ConversationMember, ConversationMember.conversation_id == Conversation.id)
+        .join(counts, counts.c.conversation_id == Conversation.id)
+        .where(ConversationMember.user_id == user.id)
+        .order_by(Conversation.id)
+    ).all()
+    return [
+        RoomOut(id=r.id, title=r.title, member_count=r.member_count) for r in rows
+    ]
+
+
+@router.post("/rooms/{room_id}/members", response_model=RoomOut)
+def add_room_member(
+    room_id: int,
+    payload: AddRoomMemberRequest,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    _require_member(db, room_id, user.id)
+    if db.get(User, payload.user_id) is None:
+        raise HTTPException(status_code=404, detail="未找到该用户")
+    if db.get(ConversationMember, (room_id, payload.user_id)) is not None:
+        raise HTTPException(status_code=400, detail="已是群成员")
+    count = _member_count(db, room_id)
+    if count >= settings.room_max_members:
+        raise HTTPException(status_code=400, detail="群成员数超过上限")
+    db.add(ConversationMember(conversation_id=room_id, user_id=payload.user_id))
+    db.commit()
+    rooms.invalidate(room_id)
+    room = db.get(Conversation, room_id)
+    assert room is not None
+    return RoomOut(id=room.id, title=room.title, member_count=count + 1)
+
+
+@router.delete(
+    "/rooms/{room_id}/members/me", status_code=status.HTTP_204_NO_CONTENT
+)
+def leave_room(
+    room_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    _require_member(db, room_id, user.id)
+    db.execute(
+        delete(ConversationMember).where(
+            ConversationMember.conversation_id == room_id,
+            ConversationMember.user_id == user.id,
         )
-        .order_by(Message.created_at)
-    ).scalars()
-    return list(rows)
+    )
+    db.commit()
+    rooms.invalidate(room_id)
+
+
+@router.get("/rooms/{room_id}/messages", response_model=MessagePage)
+def room_history(
+    room_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    _require_member(db, room_id, user.id)
+    return _history_page(
+        db, room_key(room_id), before_id, after_id, limit, room_id=room_id
+    )
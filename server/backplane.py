@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy.engine import make_url
+
+from .config import settings
+from .db import run_db
+from .frames import dumps, type_of
+
+
+logger = logging.getLogger(__name__)
+
+# 本地投递回调：(目标用户 id 或群 id, 已编码的帧文本, 需跳过的本地连接 id, 帧内消息 id)
+DeliverCallback = Callable[[int, str, Optional[int], int], Awaitable[None]]
+# 按 (帧类型, 消息 id) 从库中重建消息帧；消息不存在时返回 None
+LoadFrameCallback = Callable[[str, int], Awaitable[Optional[str]]]
+
+
+class Backplane(ABC):
+    """跨进程投递总线：发往某用户（或某个群）的帧先投递给本进程的连接，再转发给其他 worker。
+
+    群消息只按群 id 转发一次，由每个 worker 用本地的成员缓存展开到自己的连接。
+    """
+
+    def __init__(self) -> None:
+        self._deliver: Optional[DeliverCallback] = None
+        self._deliver_room: Optional[DeliverCallback] = None
+        self._load_frame: Optional[LoadFrameCallback] = None
+
+    async def start(
+        self,
+        deliver: DeliverCallback,
+        deliver_room: Optional[DeliverCallback] = None,
+        load_frame: Optional[LoadFrameCallback] = None,
+    ) -> None:
+        self._deliver = deliver
+        self._deliver_room = deliver_room
+        self._load_frame = load_frame
+
+    async def stop(self) -> None:
+        self._deliver = None
+        self._deliver_room = None
+        self._load_frame = None
+
+    @abstractmethod
+    async def publish(
+        self,
+        user_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        # exclude 为本进程内的连接 id（如发送方自己的连接），只对本地投递生效
+        ...
+
+    @abstractmethod
+    async def publish_room(
+        self,
+        room_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        ...
+
+
+class InProcessBackplane(Backplane):
+    """单进程部署：直接投递给本进程内的连接。"""
+
+    async def publish(
+        self,
+        user_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        if self._deliver is not None:
+            await self._deliver(user_id, frame, exclude, message_id)
+
+    async def publish_room(
+        self,
+        room_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        if self._deliver_room is not None:
+            await self._deliver_room(room_id, frame, exclude, message_id)
+
+
+def _psycopg2_connect(dsn: str) -> Any:
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+class PostgresBackplane(Backplane):
+    """基于 Postgres LISTEN/NOTIFY 的多 worker / 多节点投递。
+
+    每个 worker 监听同一个频道；通知里带有发布者 id，发布者自己的通知会被忽略
+    （本地连接在 publish 时已直接投递）。帧超出 NOTIFY 负载上限时只发送帧类型与消息 id，
+    由接收方 worker 按 id 从库中读取消息并重建帧。connect 可替换为本地替身连接，便于测试。
+    监听连接通过 loop.add_reader 接入事件循环，需要 selector 类事件循环（Linux 下的默认实现 / uvloop）。
+    """
+
+    # NOTIFY 负载上限为 8000 字节
+    MAX_PAYLOAD = 7999
+    RECONNECT_DELAY = 1.0
+
+    def __init__(
+        self,
+        dsn: str,
+        channel: str,
+        connect: Callable[[str], Any] = _psycopg2_connect,
+    ) -> None:
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self._connect = connect
+        self._origin = uuid.uuid4().hex
+        self._listen_conn: Any = None
+        self._publish_conn: Any = None
+        self._publish_lock = threading.Lock()
+        # (是否为群, 用户 id 或群 id, 帧或帧类型, 是否需要按 id 重建帧, 消息 id)
+        self._inbox: Optional[asyncio.Queue[tuple[bool, int, str, bool, int]]] = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(
+        self,
+        deliver: DeliverCallback,
+        deliver_room: Optional[DeliverCallback] = None,
+        load_frame: Optional[LoadFrameCallback] = None,
+    ) -> None:
+        await super().start(deliver, deliver_room, load_frame)
+        self._inbox = asyncio.Queue()
+        await self._listen()
+        # 单个消费任务按到达顺序投递，保持同一发送方的消息顺序
+        self._tasks.append(
+            asyncio.create_task(self._drain_inbox(), name="backplane-inbox")
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        self._close_listener()
+        if self._publish_conn is not None:
+            self._publish_conn.close()
+            self._publish_conn = None
+        await super().stop()
+
+    async def publish(
+        self,
+        user_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        if self._deliver is not None:
+            await self._deliver(user_id, frame, exclude, message_id)
+        await self._forward(
+            {"o": self._origin, "u": user_id, "m": message_id, "f": frame}
+        )
+
+    async def publish_room(
+        self,
+        room_id: int,
+        frame: str,
+        exclude: Optional[int] = None,
+        message_id: int = 0,
+    ) -> None:
+        if self._deliver_room is not None:
+            await self._deliver_room(room_id, frame, exclude, message_id)
+        await self._forward(
+            {"o": self._origin, "r": room_id, "m": message_id, "f": frame}
+        )
+
+    async def _forward(self, data: Dict[str, Any]) -> None:
+        envelope = dumps(data)
+        if len(envelope.encode("utf-8")) > self.MAX_PAYLOAD:
+            # 超出 NOTIFY 上限：消息已落库，只转发帧类型与消息 id，由接收方按 id 重建帧
+            kind = type_of(data["f"])
+            if kind is None or not data["m"]:
+                logger.warning("frame too large for NOTIFY and not a message, skipped")
+                return
+            data = {k: v for k, v in data.items() if k != "f"}
+            data["t"] = kind
+            envelope = dumps(data)
+        try:
+            await run_db(self._notify, envelope)
+        except Exception:  # noqa: BLE001
+            logger.exception("backplane publish failed")
+
+    def _notify(self, envelope: str) -> None:
+        # 在 DB 线程池中执行；发布连接断开后按需重连
+        with self._publish_lock:
+            if self._publish_conn is None or self._publish_conn.closed:
+                self._publish_conn = self._connect(self.dsn)
+            with self._publish_conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, envelope))
+
+    async def _listen(self) -> None:
+        conn = await run_db(self._connect, self.dsn)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        self._listen_conn = conn
+        asyncio.get_running_loop().add_reader(conn.fileno(), self._on_readable)
+
+    def _close_listener(self) -> None:
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+        except Exception:  # noqa: BLE001
+            pass
+        try:
+            conn.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+    def _on_readable(self) -> None:
+        conn = self._listen_conn
+        if conn is None or self._inbox is None:
+            return
+        try:
+            conn.poll()
+        except Exception:  # noqa: BLE001
+            logger.exception("backplane listener lost, reconnecting")
+            self._close_listener()
+            self._tasks = [t for t in self._tasks if not t.done()]
+            self._tasks.append(
+                asyncio.create_task(self._reconnect(), name="backplane-reconnect")
+            )
+            return
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            try:
+                envelope = json.loads(note.payload)
+            except ValueError:
+                continue
+            if envelope.get("o") == self._origin:
+                continue
+            is_room = "r" in envelope
+            target = int(envelope["r"] if is_room else envelope["u"])
+            by_id = "f" not in envelope
+            self._inbox.put_nowait(
+                (
+                    is_room,
+                    target,
+                    envelope["t"] if by_id else envelope["f"],
+                    by_id,
+                    int(envelope.get("m", 0)),
+                )
+            )
+
+    async def _reconnect(self) -> None:
+        while self._listen_conn is None:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            try:
+                await self._listen()
+            except Exception:  # noqa: BLE001
+                logger.warning("backplane reconnect failed, retrying")
+
+    async def _drain_inbox(self) -> None:
+        assert self._inbox is not None
+        while True:
+            is_room, target, frame, by_id, message_id = await self._inbox.get()
+            deliver = self._deliver_room if is_room else self._deliver
+            if deliver is None:
+                continue
+            try:
+                if by_id:
+                    # 顺序投递：重建期间后续通知在队列中等待，不会越过这条消息
+                    if self._load_frame is None:
+                        continue
+                    loaded = await self._load_frame(frame, message_id)
+                    if loaded is None:
+                        continue
+                    frame = loaded
+                await deliver(target, frame, None, message_id)
+            except Exception:  # noqa: BLE001
+                logger.exception("backplane delivery failed")
+
+
+def create_backplane() -> Backplane:
+    if settings.backplane == "postgres":
+        dsn = make_url(settings.database_url).set(drivername="postgresql")
+        return PostgresBackplane(
+            dsn.render_as_string(hide_password=False), settings.backplane_channel
+        )
+    if settings.backplane != "inprocess":
+        raise ValueError(f"unknown backplane: {settings.backplane}")
+    return InProcessBackplane()
+
+
+backplane = create_backplane()
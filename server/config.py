@@ -8,6 +8,59 @@ class Settings(BaseSettings):
     jwt_secret: str = "dev-secret"
     jwt_alg: str = "HS256"
     jwt_expire_minutes: int = 60
+    # 密码哈希进程池大小（0 表示使用 CPU 核数）与允许排队的最大任务数，超出时返回 503
+    hash_workers: int = 0
+    hash_queue_max: int = 64
+    # 鉴权缓存（已解码 token 与用户行）的有效秒数与最大条目数
+    auth_cache_ttl_seconds: int = 60
+    auth_cache_max_entries: int = 10000
+    # 执行同步数据库调用的专用线程数（WebSocket 持久化等）
+    db_executor_workers: int = 8
+    # 连接池：常驻连接数、允许临时溢出的连接数、取连接的最长等待秒数、连接回收秒数。
+    # 应不小于 db_executor_workers 加上同步 REST 接口的并发数；WebSocket 不常驻占用连接
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 10.0
+    db_pool_recycle: int = 1800
+    # 写后消息写入器：每批最多条数与最长等待毫秒数（group commit）
+    writer_batch_size: int = 256
+    writer_flush_ms: int = 5
+    # 跨 worker 投递总线："inprocess"（仅单 worker）或 "postgres"（LISTEN/NOTIFY）
+    backplane: str = "inprocess"
+    backplane_channel: str = "socket_chat"
+    # 每个连接出站队列的高水位（帧数）；溢出时 "drop" 丢弃新帧或 "disconnect" 断开慢消费者
+    # （携带消息的帧在两种策略下都会断开，客户端重连后补发）
+    ws_send_queue_max: int = 1000
+    ws_slow_consumer_policy: str = "disconnect"
+    # 应用层心跳：空闲超过 interval 秒发送 ping，超过 timeout 秒无任何上行帧则断开
+    ws_ping_interval_seconds: float = 20.0
+    ws_ping_timeout_seconds: float = 60.0
+    # 重连补发：每个 sync 帧的消息条数，以及单次补发的最大条数（超出后客户端改用历史接口）
+    sync_batch_size: int = 200
+    sync_max_messages: int = 5000
+    # 客户端 ack 推进的投递水位成批写库的间隔
+    ack_flush_ms: int = 1000
+    # ack 生效前的等待：期间经投递总线乱序到达（id 更小、晚于已 ack 的消息）的帧先进入连接，
+    # 水位不会越过它们；应大于跨 worker 投递的最大延迟
+    ack_grace_ms: int = 2000
+    # 群成员集合的进程内缓存：有效秒数（其他 worker 修改成员后最多延迟这么久生效）与最多缓存的群数
+    room_cache_ttl_seconds: int = 30
+    room_cache_max_rooms: int = 10000
+    # 单个群的成员上限
+    room_max_members: int = 10000
+    # 好友概览中未读数的上限：计数最多扫描这么多条，更多时客户端显示为 “N+”
+    unread_count_cap: int = 99
+    # /admin 诊断接口的令牌（请求头 X-Admin-Token）；为空时诊断接口关闭
+    admin_token: str = ""
+    # 采样 profiler 的默认采样间隔毫秒数与单次最长运行秒数（防止忘记关闭）
+    profiler_interval_ms: float = 10.0
+    profiler_max_seconds: float = 300.0
+    # 慢请求捕获：REST 请求或 WebSocket 帧超过该毫秒数时记录耗时分项与调用栈（0 为关闭，
+    # 可在运行中通过 /admin/slow 修改），以及保留的最近记录条数
+    slow_request_ms: float = 0
+    slow_request_log_size: int = 100
+    # uvicorn worker 数；大于 1 时需要使用 postgres 投递总线
+    workers: int = 1
 
     model_config = SettingsConfigDict(
         env_file=".env",
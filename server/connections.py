@@ -0,0 +1,247 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import AbstractSet, Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from .config import settings
+from .metrics import FRAMES_DROPPED, FRAMES_OUT, frame_type
+
+
+logger = logging.getLogger(__name__)
+
+# 出站队列溢出（慢消费者）时的关闭码
+CLOSE_SLOW_CONSUMER = 4429
+# 关闭帧本身也可能卡在对端的 TCP 窗口上，最多等待这么久
+CLOSE_TIMEOUT = 5.0
+# 每个连接最多记录这么多条未确认的消息帧；客户端长期不 ack 时超出部分不再跟踪
+UNACKED_MAX = 10000
+
+
+class Connection:
+    """单个 WebSocket 连接：出站帧进入有界队列，由连接自己的写任务发送。
+
+    发送方只做 put_nowait，永远不会等待对端的 TCP 窗口；队列超过高水位时按配置
+    丢弃该帧（"drop"）或断开这个慢消费者（"disconnect"）。携带消息的帧从不丢弃，
+    否则客户端随后 ack 的更大 id 会让被丢弃的消息落到投递水位之下。
+
+    连接按出站顺序记录尚未被客户端确认的消息帧，ack 只能推进到客户端确实收到的位置。
+    """
+
+    __slots__ = (
+        "id",
+        "user_id",
+        "websocket",
+        "closed",
+        "dropped",
+        "last_seen",
+        "sent_up_to",
+        "lossy",
+        "_queue",
+        "_unacked",
+        "_held",
+        "_writer",
+        "_closer",
+    )
+
+    def __init__(self, conn_id: int, user_id: int, websocket: WebSocket) -> None:
+        self.id = conn_id
+        self.user_id = user_id
+        self.websocket = websocket
+        self.closed = False
+        self.dropped = 0
+        # 最近一次收到上行帧的时间（time.monotonic），供心跳判断空闲
+        self.last_seen = time.monotonic()
+        # 写任务已写出的最大消息 id
+        self.sent_up_to = 0
+        # 未确认记录溢出后置位：无法再判断客户端收到了哪些消息，不再采信它的 ack
+        self.lossy = False
+        self._queue: asyncio.Queue[Tuple[str, int]] = asyncio.Queue(
+            maxsize=settings.ws_send_queue_max
+        )
+        # 补发离线消息期间暂存的实时帧，补发完成后按顺序放入出站队列
+        self._held: Optional[List[Tuple[str, int]]] = None
+        # 已入队、尚未被 ack 覆盖的消息帧，按出站顺序：(帧内最大 id, 帧内最小 id)
+        self._unacked: Deque[Tuple[int, int]] = deque()
+        self._writer: Optional[asyncio.Task] = None
+        self._closer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(
+            self._drain(), name=f"ws-writer-{self.id}"
+        )
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def send(self, frame: str, message_id: int = 0) -> bool:
+        # message_id 为帧内携带的最大消息 id（无消息的帧为 0）
+        if self.closed:
+            return False
+        if self._held is not None:
+            if len(self._held) >= settings.ws_send_queue_max:
+                return self._overflow(message_id)
+            self._held.append((frame, message_id))
+            return True
+        return self.enqueue(frame, message_id)
+
+    def enqueue(self, frame: str, message_id: int = 0, first_id: int = 0) -> bool:
+        # 直接放入出站队列，不受 hold() 影响；first_id 为帧内最小消息 id（补发帧）
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((frame, message_id))
+        except asyncio.QueueFull:
+            return self._overflow(message_id)
+        if message_id:
+            unacked = self._unacked
+            if len(unacked) >= UNACKED_MAX:
+                unacked.popleft()
+                self.lossy = True
+            unacked.append((message_id, first_id or message_id))
+        return True
+
+    def hold(self) -> None:
+        self._held = []
+
+    def release(self, skip_upto: int = 0) -> None:
+        # id 不超过 skip_upto 的消息已包含在补发中，丢弃以免重复
+        held, self._held = self._held, None
+        for frame, message_id in held or ():
+            if message_id and message_id <= skip_upto:
+                continue
+            self.enqueue(frame, message_id)
+
+    def confirm(self, up_to: int) -> None:
+        # 客户端 ack 的是收到过的最大 id：携带该 id 的帧及出站顺序在它之前的帧都已收到
+        unacked = self._unacked
+        for i, (message_id, _) in enumerate(unacked):
+            if message_id == up_to:
+                for _ in range(i + 1):
+                    unacked.popleft()
+                break
+
+    def ack_floor(self) -> Optional[int]:
+        # 水位不能越过的位置：尚未确认的帧与暂存帧中的最小消息 id 减一；没有时为 None
+        ids = [first for _, first in self._unacked]
+        ids.extend(message_id for _, message_id in self._held or () if message_id)
+        return min(ids) - 1 if ids else None
+
+    def _overflow(self, message_id: int = 0) -> bool:
+        self.dropped += 1
+        FRAMES_DROPPED.inc()
+        if settings.ws_slow_consumer_policy == "disconnect" or message_id:
+            logger.info("evicting slow consumer, user %s", self.user_id)
+            self.evict(CLOSE_SLOW_CONSUMER)
+        return False
+
+    def evict(self, code: int) -> None:
+        # 停止写任务并异步发送关闭帧；接收循环随后收到断开并注销连接
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+        self._closer = asyncio.create_task(self._close(code))
+
+    async def close(self) -> None:
+        self.closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    async def _close(self, code: int) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), CLOSE_TIMEOUT)
+        except Exception:  # noqa: BLE001
+            pass
+
+    async def _drain(self) -> None:
+        queue = self._queue
+        websocket = self.websocket
+        try:
+            while True:
+                frame, message_id = await queue.get()
+                await websocket.send_text(frame)
+                if message_id > self.sent_up_to:
+                    self.sent_up_to = message_id
+                FRAMES_OUT.labels(frame_type(frame)).inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            # 对端已断开：不再接收新的出站帧
+            self.closed = True
+
+
+class ConnectionRegistry:
+    """在线连接表：按用户与连接 id 双重索引，支持多端同时在线，注册与注销均为 O(1)。"""
+
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+        self._by_id: Dict[int, Connection] = {}
+        # 内层用 dict 而非 list：按连接 id 删除为 O(1)，且保留注册顺序
+        self._by_user: Dict[int, Dict[int, Connection]] = {}
+        self._peak = 0
+
+    def register(self, user_id: int, websocket: WebSocket) -> Connection:
+        conn = Connection(next(self._ids), user_id, websocket)
+        self._by_id[conn.id] = conn
+        self._by_user.setdefault(user_id, {})[conn.id] = conn
+        if len(self._by_id) > self._peak:
+            self._peak = len(self._by_id)
+        return conn
+
+    def unregister(self, conn: Connection) -> None:
+        if self._by_id.pop(conn.id, None) is None:
+            return
+        sessions = self._by_user.get(conn.user_id)
+        if sessions is not None:
+            sessions.pop(conn.id, None)
+            if not sessions:
+                del self._by_user[conn.user_id]
+
+    def for_user(self, user_id: int) -> List[Connection]:
+        sessions = self._by_user.get(user_id)
+        return list(sessions.values()) if sessions else []
+
+    def for_users(self, user_ids: AbstractSet[int]) -> Iterator[Connection]:
+        # 群扇出：遍历成员集合与在线用户中较小的一方，代价为 O(min(成员数, 在线用户数))
+        by_user = self._by_user
+        if len(user_ids) <= len(by_user):
+            for user_id in user_ids:
+                sessions = by_user.get(user_id)
+                if sessions:
+                    yield from sessions.values()
+        else:
+            for user_id, sessions in by_user.items():
+                if user_id in user_ids:
+                    yield from sessions.values()
+
+    def count(self) -> int:
+        return len(self._by_id)
+
+    def user_count(self) -> int:
+        return len(self._by_user)
+
+    def queue_depths(self) -> Tuple[int, int]:
+        # 所有连接出站队列的总深度与最大深度；只在抓取指标时调用
+        total = deepest = 0
+        for conn in list(self._by_id.values()):
+            depth = conn.queue_size()
+            total += depth
+            if depth > deepest:
+                deepest = depth
+        return total, deepest
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self._by_id),
+            "users": len(self._by_user),
+            "peak_connections": self._peak,
+        }
+
+    def __len__(self) -> int:
+        return len(self._by_id)
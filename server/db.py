@@ -1,18 +1,104 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 from .config import settings
+from .metrics import callback_gauge
+
+
+T = TypeVar("T")
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+engine = create_engine(
+    settings.database_url,
+    pool_pre_ping=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
 
+class _PoolCounters:
+    # 连接池累计取用次数与同时借出连接数的峰值（高水位），用于观察池是否饱和
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.peak_checked_out = 0
+
+    def on_checkout(self) -> None:
+        checked_out = engine.pool.checkedout()  # type: ignore[attr-defined]
+        with self._lock:
+            self.checkouts += 1
+            if checked_out > self.peak_checked_out:
+                self.peak_checked_out = checked_out
+
+
+_pool_counters = _PoolCounters()
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(*_: Any) -> None:
+    _pool_counters.on_checkout()
+
+
+def pool_stats() -> Dict[str, Any]:
+    pool = engine.pool
+    capacity = settings.db_pool_size + settings.db_max_overflow
+    checked_out = pool.checkedout()  # type: ignore[attr-defined]
+    return {
+        "size": pool.size(),  # type: ignore[attr-defined]
+        "max_overflow": settings.db_max_overflow,
+        "checked_in": pool.checkedin(),  # type: ignore[attr-defined]
+        "checked_out": checked_out,
+        "overflow": max(0, pool.overflow()),  # type: ignore[attr-defined]
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+        "peak_checked_out": _pool_counters.peak_checked_out,
+        "checkouts": _pool_counters.checkouts,
+    }
+
+
+def _pool_connections() -> Dict[Tuple[str], int]:
+    stats = pool_stats()
+    return {
+        (state,): stats[state] for state in ("checked_out", "checked_in", "overflow")
+    }
+
+
+callback_gauge(
+    "chat_db_pool_connections", "数据库连接池中的连接数", _pool_connections, ["state"]
+)
+
+# 专用的有界线程池：WebSocket 等异步路径中的同步 SQLAlchemy 调用在此执行，
+# 避免一次 Postgres 往返阻塞整个事件循环。
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.db_executor_workers, thread_name_prefix="db"
+)
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    # 带上调用方的 contextvars（慢请求捕获据此统计数据库耗时）
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        db_executor, partial(ctx.run, fn, *args, **kwargs)
+    )
+
+
 def init_db() -> None:
     from . import models  # noqa: F401
+    from .migrations import upgrade
 
     Base.metadata.create_all(engine)
+    upgrade(engine)
@@ -1,9 +1,13 @@
+import time
 from typing import Generator, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
+from .cache import TTLCache
+from .config import settings
 from .db import SessionLocal
 from .models import User
 from .security import decode_access_token
@@ -19,24 +23,95 @@ def get_db() -> Generator[Session, None, None]:
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
+# 鉴权缓存：token -> user_id，以及 user_id -> 已脱离 Session 的 User（只读使用）。
+# /api/me、好友列表、历史轮询等请求命中缓存时不再访问 Postgres。
+token_cache: TTLCache[str, int] = TTLCache(
+    settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds
+)
+user_cache: TTLCache[int, User] = TTLCache(
+    settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds
+)
+
+
+def _user_id_from_token(token: str) -> int:
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+    payload = decode_access_token(token)
+    user_id = int(payload.get("sub"))
+    # 缓存时间不超过 token 的剩余有效期
+    ttl = min(settings.auth_cache_ttl_seconds, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(token, user_id, ttl)
+    return user_id
+
+
+def load_user(user_id: int) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is None:
+        with SessionLocal() as db:
+            user = db.get(User, user_id)
+        if user is not None:
+            user_cache.set(user_id, user)
+    return user
+
+
+def peek_user(token: str) -> Optional[User]:
+    # 只查缓存、不访问数据库；供事件循环上的快速路径使用
+    user_id = token_cache.get(token)
+    if user_id is None:
+        return None
+    return user_cache.get(user_id)
+
+
+def cached_user(user_id: int) -> Optional[User]:
+    # 只查缓存、不访问数据库
+    return user_cache.get(user_id)
+
+
+def authenticate_token(token: str) -> Optional[User]:
+    try:
+        user_id = _user_id_from_token(token)
+    except Exception:  # noqa: BLE001
+        return None
+    return load_user(user_id)
+
+
+def invalidate_user(user_id: int) -> None:
+    user_cache.pop(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _on_user_changed(mapper, connection, target: User) -> None:  # noqa: ANN001
+    invalidate_user(target.id)
+    # 提交后再失效一次，避免其他线程在提交前读到旧行并重新写入缓存
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("invalidate_users", set()).add(target.id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _on_commit(session: Session) -> None:
+    for user_id in session.info.pop("invalidate_users", ()):
+        invalidate_user(user_id)
+
 
 def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
-    db: Session = Depends(get_db),
 ) -> User:
     if credentials is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
         )
     try:
-        payload = decode_access_token(credentials.credentials)
-        user_id = int(payload.get("sub"))
+        user_id = _user_id_from_token(credentials.credentials)
     except Exception:  # noqa: BLE001
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
 
-    user = db.get(User, user_id)
+    user = load_user(user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found"
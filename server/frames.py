@@ -0,0 +1,26 @@
+import json
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：pip install socket-chat[speedups]
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(data: Any) -> str:
+    # 调用方负责把 datetime 等转成字符串，保证两种后端输出一致
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def message_frame(frame_type: str, payload: str) -> str:
+    # payload 为已编码的消息 JSON；sent/recv 等帧直接拼接复用，不再重复序列化
+    return '{"type":"' + frame_type + '","message":' + payload + "}"
+
+
+def type_of(frame: str) -> Optional[str]:
+    # 本进程编码的帧都以 {"type":"..." 开头，无需解析整帧即可取得类型
+    if frame.startswith('{"type":"'):
+        return frame[9 : frame.find('"', 9)]
+    return None
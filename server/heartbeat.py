@@ -0,0 +1,89 @@
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional
+
+from .config import settings
+from .connections import Connection
+
+
+# 心跳超时被回收的连接使用的关闭码
+CLOSE_HEARTBEAT_TIMEOUT = 4408
+PING_FRAME = '{"type":"ping"}'
+
+
+class Heartbeat:
+    """应用层心跳：一个定时轮驱动所有连接的 ping 与空闲回收，而不是每个连接一个 sleep 任务。
+
+    轮上每个槽位存放到期的连接；每个 tick 只处理当前槽位。连接收到任意帧时只更新
+    last_seen，不移动其在轮上的位置；到期时再根据空闲时长决定发 ping、回收或顺延。
+    """
+
+    def __init__(self, interval: float, timeout: float, tick: float = 1.0) -> None:
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self._interval_ticks = max(1, math.ceil(interval / tick))
+        self._wheel: List[Dict[int, Connection]] = [
+            {} for _ in range(self._interval_ticks + 1)
+        ]
+        self._slot_of: Dict[int, int] = {}
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, conn: Connection) -> None:
+        self._schedule(conn)
+
+    def remove(self, conn: Connection) -> None:
+        slot = self._slot_of.pop(conn.id, None)
+        if slot is not None:
+            self._wheel[slot].pop(conn.id, None)
+
+    def _schedule(self, conn: Connection, ticks: Optional[int] = None) -> None:
+        # ticks 不超过 interval 对应的 tick 数，轮的大小因此足够
+        if ticks is None:
+            ticks = self._interval_ticks
+        slot = (self._cursor + ticks) % len(self._wheel)
+        self._wheel[slot][conn.id] = conn
+        self._slot_of[conn.id] = slot
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="ws-heartbeat")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance(time.monotonic())
+
+    def advance(self, now: float) -> None:
+        self._cursor = (self._cursor + 1) % len(self._wheel)
+        due, self._wheel[self._cursor] = self._wheel[self._cursor], {}
+        for conn in due.values():
+            del self._slot_of[conn.id]
+            if conn.closed:
+                continue
+            idle = now - conn.last_seen
+            if idle >= self.timeout:
+                # 对端已失联（休眠、NAT 超时等）：回收连接，不再向其写入
+                conn.evict(CLOSE_HEARTBEAT_TIMEOUT)
+                continue
+            if idle >= self.interval:
+                conn.send(PING_FRAME)
+            # 距超时不足一个 interval 时提前检查，回收时间不会比 timeout 晚出一个 interval
+            ticks = math.ceil((self.timeout - idle) / self.tick)
+            self._schedule(conn, max(1, min(self._interval_ticks, ticks)))
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+
+heartbeat = Heartbeat(
+    interval=settings.ws_ping_interval_seconds,
+    timeout=settings.ws_ping_timeout_seconds,
+)
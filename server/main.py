@@ -1,9 +1,34 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+from .admin import router as admin_router
 from .api import router as api_router
-from .db import init_db
-from .ws import router as ws_router
+from .backplane import backplane
+from .config import settings
+from .db import init_db, pool_stats
+from .heartbeat import heartbeat
+from .metrics import RequestMetricsMiddleware, registry as metrics_registry
+from .profiling import SlowRequestMiddleware, profiler
+from .security import HashPoolBusy, hash_pool
+from .sync import watermarks
+from .writer import message_writer
+from .ws import (
+    deliver_local,
+    deliver_room_local,
+    load_message_frame,
+    registry,
+    router as ws_router,
+)
+
+
+async def _service_busy(request: Request, exc: Exception) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "服务繁忙，请稍后重试"},
+        headers={"Retry-After": "1"},
+    )
 
 
 def create_app() -> FastAPI:
@@ -15,17 +40,76 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(SlowRequestMiddleware)
+    # 放在最外层：耗时包含 CORS 等中间件
+    app.add_middleware(RequestMetricsMiddleware)
 
     app.include_router(api_router, prefix="/api")
     app.include_router(ws_router)
+    app.include_router(admin_router, prefix="/admin")
+
+    # 密码哈希排队已满、连接池在 db_pool_timeout 内取不到连接：按过载处理，而不是 500
+    app.add_exception_handler(HashPoolBusy, _service_busy)
+    app.add_exception_handler(PoolTimeoutError, _service_busy)
 
     @app.get("/healthz")
     def healthz() -> dict[str, str]:
         return {"status": "ok"}
 
+    @app.get("/stats")
+    async def stats() -> dict[str, dict]:
+        # 连接数与数据库连接池占用：大量空闲 WebSocket 不应占用池中连接
+        return {"connections": registry.stats(), "db_pool": pool_stats()}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> PlainTextResponse:
+        # Prometheus 文本格式；每个 worker 进程各自暴露，由抓取端按实例汇总
+        return PlainTextResponse(
+            metrics_registry.render(),
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
     @app.on_event("startup")
     def _on_startup() -> None:
         init_db()
+        hash_pool.start()
+
+    @app.on_event("shutdown")
+    def _on_shutdown() -> None:
+        hash_pool.shutdown()
+        profiler.stop()
+
+    @app.on_event("startup")
+    async def _start_writer() -> None:
+        await message_writer.start()
+
+    @app.on_event("shutdown")
+    async def _stop_writer() -> None:
+        await message_writer.stop()
+
+    @app.on_event("startup")
+    async def _start_watermarks() -> None:
+        await watermarks.start()
+
+    @app.on_event("shutdown")
+    async def _stop_watermarks() -> None:
+        await watermarks.stop()
+
+    @app.on_event("startup")
+    async def _start_heartbeat() -> None:
+        await heartbeat.start()
+
+    @app.on_event("shutdown")
+    async def _stop_heartbeat() -> None:
+        await heartbeat.stop()
+
+    @app.on_event("startup")
+    async def _start_backplane() -> None:
+        await backplane.start(deliver_local, deliver_room_local, load_message_frame)
+
+    @app.on_event("shutdown")
+    async def _stop_backplane() -> None:
+        await backplane.stop()
 
     return app
 
@@ -33,8 +117,16 @@ def create_app() -> FastAPI:
 def run() -> None:
     import uvicorn
 
+    if settings.workers > 1 and settings.backplane == "inprocess":
+        # 进程内投递无法跨 worker，连在其他进程的用户将收不到推送
+        raise SystemExit("WORKERS > 1 requires BACKPLANE=postgres")
     uvicorn.run(
-        "server.main:create_app", factory=True, host="0.0.0.0", port=8000, reload=False
+        "server.main:create_app",
+        factory=True,
+        host="0.0.0.0",
+        port=8000,
+        reload=False,
+        workers=settings.workers,
     )
 
 
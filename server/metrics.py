@@ -0,0 +1,310 @@
+"""进程内指标与 Prometheus 文本格式输出（GET /metrics）。
+
+热路径上的更新只做属性自增与一次 bisect，不加锁：绝大多数更新发生在事件循环线程，
+线程池中的少量更新（如密码哈希耗时）在 GIL 下极少数情况会丢失一次计数，对容量规划无影响。
+回调型 Gauge 只在抓取时求值，平时零开销。
+"""
+
+import bisect
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .frames import type_of
+
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{n}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        ...
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._children: Dict[LabelValues, _CounterChild] = {}
+        self._default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, _CounterChild())
+        return child
+
+    def inc(self, amount: float = 1) -> None:
+        assert self._default is not None, "counter has labels"
+        self._default.value += amount
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(child.value)}"
+
+
+class CallbackGauge(_Metric):
+    """抓取时调用 fn 取值；fn 返回数值，或 {标签值元组: 数值}。"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], object],
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def samples(self) -> Iterable[str]:
+        value = self.fn()
+        if isinstance(value, dict):
+            for values, v in value.items():
+                labels = _format_labels(self.labelnames, values)
+                yield f"{self.name}{labels} {_format_value(float(v))}"
+        else:
+            yield f"{self.name} {_format_value(float(value))}"  # type: ignore[arg-type]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # 每个桶单独计数（非累积），最后一个为 +Inf；输出时再累加
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._children: Dict[LabelValues, _HistogramChild] = {}
+        self._default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, _HistogramChild(self.bounds))
+        return child
+
+    def observe(self, value: float) -> None:
+        assert self._default is not None, "histogram has labels"
+        self._default.observe(value)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                labels = _format_labels(self.labelnames, values, le)
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = list(metric.samples())
+            except Exception:  # noqa: BLE001
+                # 回调失败不影响其他指标的输出
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    metric = Counter(name, help, labelnames)
+    registry.register(metric)
+    return metric
+
+
+def callback_gauge(
+    name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = ()
+) -> CallbackGauge:
+    metric = CallbackGauge(name, help, fn, labelnames)
+    registry.register(metric)
+    return metric
+
+
+def histogram(
+    name: str,
+    help: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS,
+) -> Histogram:
+    metric = Histogram(name, help, labelnames, buckets)
+    registry.register(metric)
+    return metric
+
+
+# 各模块共用的指标；回调型 Gauge 在拥有对应状态的模块中注册
+FRAMES_IN = counter("chat_ws_frames_in_total", "收到的 WebSocket 帧数", ["type"])
+FRAMES_OUT = counter("chat_ws_frames_out_total", "发出的 WebSocket 帧数", ["type"])
+FRAMES_DROPPED = counter(
+    "chat_ws_frames_dropped_total", "出站队列溢出而丢弃的帧数（慢消费者）"
+)
+MESSAGE_PERSIST_SECONDS = histogram(
+    "chat_message_persist_seconds", "消息从提交到写入器到落库提交完成的耗时"
+)
+WRITER_BATCH_SECONDS = histogram(
+    "chat_writer_batch_seconds", "写入器一次批量 INSERT 与提交的耗时"
+)
+WRITER_BATCH_SIZE = histogram(
+    "chat_writer_batch_size",
+    "写入器每批消息条数",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 256, 512),
+)
+FANOUT_SECONDS = histogram(
+    "chat_fanout_seconds", "落库后投递给接收方连接（含投递总线转发）的耗时", ["kind"]
+)
+HASH_SECONDS = histogram(
+    "chat_password_hash_seconds", "密码哈希/校验耗时（含进程池排队）", ["op"]
+)
+HTTP_REQUEST_SECONDS = histogram(
+    "chat_http_request_seconds", "REST 请求处理耗时", ["method", "route", "status"]
+)
+
+
+# 帧类型作为标签值：只接受已知类型，避免客户端随意构造标签值
+KNOWN_FRAME_TYPES = frozenset(
+    {"auth", "send", "ack", "pong", "ping", "ready", "sent", "recv", "sync", "error"}
+)
+
+
+def frame_type(frame: str) -> str:
+    kind = type_of(frame)
+    return kind if kind in KNOWN_FRAME_TYPES else "other"
+
+
+def route_template(scope: Scope) -> str:
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    # 通过 include_router(prefix=...) 挂载的路由只记录了前缀之后的部分：
+    # 按模板的段数从实际路径中取回前缀（本项目的路由不使用 {x:path} 转换器）
+    segments = template.count("/")
+    path = scope["path"].rstrip("/") if template != "/" else scope["path"]
+    prefix = path.rsplit("/", segments)[0] if segments else ""
+    return prefix + template
+
+
+class RequestMetricsMiddleware:
+    """纯 ASGI 中间件：按路由模板（而非实际路径）记录 REST 耗时，标签数量有界。"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status: Optional[int] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route_template(scope), str(status or 500)
+            ).observe(time.perf_counter() - start)
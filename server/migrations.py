@@ -0,0 +1,148 @@
+"""幂等的 schema 迁移。
+
+create_all 只会创建缺失的表，不会修改已有表；这里补齐既有库缺失的列与索引。
+每个步骤都可重复执行，启动时由 init_db 调用，也可单独运行：python -m server.migrations
+"""
+
+import logging
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+
+logger = logging.getLogger(__name__)
+
+# 回填按 id 区间分批提交，避免长事务与整表锁
+BACKFILL_BATCH = 10000
+# 多个 worker 同时启动时用会话级 advisory lock 串行化迁移
+MIGRATION_LOCK_ID = 0x50C4E7
+
+
+def _column_nullable(conn: Connection, table: str, column: str) -> Optional[bool]:
+    # 列不存在时返回 None
+    row = conn.execute(
+        text(
+            "SELECT is_nullable FROM information_schema.columns "
+            "WHERE table_name = :t AND column_name = :c"
+        ),
+        {"t": table, "c": column},
+    ).first()
+    if row is None:
+        return None
+    return row[0] == "YES"
+
+
+def _create_index(
+    conn: Connection, name: str, ddl: str, unique: bool = False
+) -> None:
+    # CONCURRENTLY 不能在事务中执行，单独使用自动提交连接
+    conn.commit()
+    auto = conn.execution_options(isolation_level="AUTOCOMMIT")
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    auto.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} {ddl}"))
+
+
+def add_message_conversation_key(conn: Connection) -> None:
+    nullable = _column_nullable(conn, "messages", "conversation_key")
+    if nullable is None:
+        conn.execute(
+            text("ALTER TABLE messages ADD COLUMN conversation_key VARCHAR(64)")
+        )
+        conn.commit()
+        nullable = True
+
+    if nullable:
+        max_id = conn.execute(
+            text("SELECT COALESCE(MAX(id), 0) FROM messages")
+        ).scalar()
+        lo = 0
+        while lo < max_id:
+            hi = lo + BACKFILL_BATCH
+            conn.execute(
+                text(
+                    "UPDATE messages SET conversation_key = 'd:' "
+                    "|| LEAST(sender_id, receiver_id) || ':' "
+                    "|| GREATEST(sender_id, receiver_id) "
+                    "WHERE id > :lo AND id <= :hi AND conversation_key IS NULL"
+                ),
+                {"lo": lo, "hi": hi},
+            )
+            conn.commit()
+            lo = hi
+        conn.execute(
+            text("ALTER TABLE messages ALTER COLUMN conversation_key SET NOT NULL")
+        )
+        conn.commit()
+
+    _create_index(
+        conn,
+        "ix_messages_conversation_key_id",
+        "ON messages (conversation_key, id)",
+    )
+
+
+def add_message_user_id_indexes(conn: Connection) -> None:
+    _create_index(
+        conn, "ix_messages_receiver_id_id", "ON messages (receiver_id, id)"
+    )
+    _create_index(conn, "ix_messages_sender_id_id", "ON messages (sender_id, id)")
+
+
+def add_message_client_msg_id(conn: Connection) -> None:
+    if _column_nullable(conn, "messages", "client_msg_id") is None:
+        conn.execute(text("ALTER TABLE messages ADD COLUMN client_msg_id VARCHAR(64)"))
+        conn.commit()
+    # 既有行为 NULL，唯一索引不约束 NULL
+    _create_index(
+        conn,
+        "uq_messages_sender_id_client_msg_id",
+        "ON messages (sender_id, client_msg_id)",
+        unique=True,
+    )
+
+
+def allow_room_messages(conn: Connection) -> None:
+    # 群聊消息没有单个接收者
+    if _column_nullable(conn, "messages", "receiver_id") is False:
+        conn.execute(
+            text("ALTER TABLE messages ALTER COLUMN receiver_id DROP NOT NULL")
+        )
+        conn.commit()
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    add_message_conversation_key,
+    add_message_user_id_indexes,
+    add_message_client_msg_id,
+    allow_room_messages,
+]
+
+
+def upgrade(engine: Engine) -> None:
+    with engine.connect() as conn:
+        # 用 try 轮询而不是阻塞等待：阻塞中的事务会让对方的 CREATE INDEX CONCURRENTLY 互相等待
+        while not conn.execute(
+            text("SELECT pg_try_advisory_lock(:k)"), {"k": MIGRATION_LOCK_ID}
+        ).scalar():
+            conn.commit()
+            time.sleep(0.5)
+        conn.commit()
+        try:
+            for step in MIGRATIONS:
+                logger.info("running migration %s", step.__name__)
+                step(conn)
+                conn.commit()
+        finally:
+            conn.execute(
+                text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATION_LOCK_ID}
+            )
+            conn.commit()
+
+
+if __name__ == "__main__":
+    from .db import engine
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
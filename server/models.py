@@ -1,11 +1,27 @@
 from datetime import datetime
+from typing import Optional
 
-from sqlalchemy import BigInteger, DateTime, ForeignKey, String, Text
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
 
 
+def conversation_key(user_a: int, user_b: int) -> str:
+    # 单聊会话的规范键：与双方顺序无关，(min, max)
+    lo, hi = sorted((user_a, user_b))
+    return f"d:{lo}:{hi}"
+
+
+def room_key(room_id: int) -> str:
+    # 群聊会话的键，与单聊共用 (conversation_key, id) 索引
+    return f"g:{room_id}"
+
+
+def room_id_of(key: str) -> Optional[int]:
+    return int(key[2:]) if key.startswith("g:") else None
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -47,10 +63,74 @@ class Message(Base):
     sender_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), index=True
     )
-    receiver_id: Mapped[int] = mapped_column(
-        ForeignKey("users.id", ondelete="CASCADE"), index=True
+    # 群聊消息没有单个接收者，为 NULL；所属群由 conversation_key（"g:<id>"）确定
+    receiver_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=True
     )
+    # 见 conversation_key() / room_key()；配合 (conversation_key, id) 复合索引，会话历史与分页只需一次索引范围扫描
+    conversation_key: Mapped[str] = mapped_column(String(64))
     body: Mapped[str] = mapped_column(Text)
+    # 客户端生成的幂等键：重连后重发同一条消息不会重复落库
+    client_msg_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow, index=True
     )
+
+    __table_args__ = (
+        Index(
+            "uq_messages_sender_id_client_msg_id",
+            "sender_id",
+            "client_msg_id",
+            unique=True,
+        ),
+        Index("ix_messages_conversation_key_id", "conversation_key", "id"),
+        # 重连补发按 (用户, id > 水位) 做范围扫描
+        Index("ix_messages_receiver_id_id", "receiver_id", "id"),
+        Index("ix_messages_sender_id_id", "sender_id", "id"),
+    )
+
+
+class DeliveryState(Base):
+    __tablename__ = "delivery_states"
+
+    # 每个用户的投递水位：已投递的最大消息 id，重连时只补发更新的消息
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    last_delivered_id: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class ReadMarker(Base):
+    __tablename__ = "read_markers"
+
+    # 每个用户在每个会话中已读到的最大消息 id；未读数 = 对方发来的 id 更大的消息数
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    conversation_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    last_read_id: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    # 群聊（房间）；单聊不建行，直接由双方 id 得到 conversation_key
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    title: Mapped[str] = mapped_column(String(100))
+    created_by: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("users.id", ondelete="SET NULL"), nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ConversationMember(Base):
+    __tablename__ = "conversation_members"
+
+    conversation_id: Mapped[int] = mapped_column(
+        ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    # 按用户查其所在的群（补发离线消息、群列表）
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,358 @@
+"""运行时诊断：按需开启的采样 profiler 与慢请求捕获，均可在运行中通过 /admin 接口开关。
+
+采样 profiler 由一个后台线程按固定间隔读取 sys._current_frames()，把所有线程的调用栈
+聚合为 flamegraph.pl / speedscope 可直接读取的折叠栈（collapsed stacks）文本。
+
+慢请求捕获：每个 REST 请求与 WebSocket 上行帧在一个 contextvar 中累计分项耗时
+（数据库、密码哈希、等待写入器落库）；超过阈值时记录分项与调用栈到环形缓冲区。
+调用栈由看门狗线程在请求仍在执行、刚超过阈值时抓取：执行该请求的线程的栈，
+以及（事件循环空闲后）该请求所在 asyncio 任务的 await 栈。
+"""
+
+import asyncio
+import contextvars
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import FrameType
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .config import settings
+from .db import engine
+from .metrics import route_template
+
+
+# 同一进程内不同调用栈的数量上限，超出后新的栈计入 "[truncated]"
+MAX_STACKS = 50000
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STDLIB = sysconfig.get_paths()["stdlib"]
+
+
+_short_names: Dict[str, str] = {}
+
+
+def _short_filename(filename: str) -> str:
+    # 项目内与标准库文件用相对路径，第三方库从 site-packages 之后开始，缩短折叠栈
+    short = _short_names.get(filename)
+    if short is None:
+        short = filename
+        marker = filename.rfind("site-packages" + os.sep)
+        if marker >= 0:
+            short = filename[marker + len("site-packages") + 1 :]
+        elif filename.startswith(_ROOT + os.sep):
+            short = filename[len(_ROOT) + 1 :]
+        elif filename.startswith(_STDLIB + os.sep):
+            short = filename[len(_STDLIB) + 1 :]
+        _short_names[filename] = short
+    return short
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_filename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame: Optional[FrameType]) -> List[str]:
+    labels: List[str] = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """采样 profiler：默认关闭；开启后按 interval 采样所有线程，最长运行 max_seconds。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stacks: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.interval = 0.0
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float, max_seconds: float) -> None:
+        with self._lock:
+            if self.running:
+                raise RuntimeError("profiler already running")
+            self._stacks = {}
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(interval, time.monotonic() + max_seconds),
+                name="sampling-profiler",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def collapsed(self) -> str:
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+    def _run(self, interval: float, deadline: float) -> None:
+        me = threading.get_ident()
+        try:
+            while not self._stop.wait(interval) and time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                frames = sys._current_frames()
+                with self._lock:
+                    for ident, frame in frames.items():
+                        if ident == me:
+                            continue
+                        stack = ";".join(
+                            [names.get(ident, str(ident)), *_collapse(frame)]
+                        )
+                        self._count(stack)
+                    self.samples += 1
+                # 及时释放对其他线程帧对象的引用
+                del frames
+        finally:
+            self.stopped_at = time.time()
+
+    def _count(self, stack: str) -> None:
+        stacks = self._stacks
+        if stack in stacks:
+            stacks[stack] += 1
+        elif len(stacks) < MAX_STACKS:
+            stacks[stack] = 1
+        else:
+            stacks["[truncated]"] = stacks.get("[truncated]", 0) + 1
+
+
+class Timings:
+    """一次 REST 请求或 WebSocket 帧的执行记录：分项耗时与执行线程。"""
+
+    __slots__ = (
+        "kind",
+        "name",
+        "start",
+        "started_at",
+        "parts",
+        "thread",
+        "loop",
+        "task",
+        "thread_stack",
+        "task_stack",
+    )
+
+    def __init__(self, kind: str, name: str) -> None:
+        self.kind = kind
+        self.name = name
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        # 分项 -> [累计秒数, 次数]
+        self.parts: Dict[str, List[float]] = {}
+        # 当前正在为该请求工作的线程；进入 DB 线程池等处时更新
+        self.thread = threading.get_ident()
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.thread_stack: Optional[List[str]] = None
+        self.task_stack: Optional[List[str]] = None
+
+    def add(self, part: str, seconds: float) -> None:
+        entry = self.parts.get(part)
+        if entry is None:
+            self.parts[part] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+_current: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def add_timing(part: str, seconds: float) -> None:
+    # 供各模块上报分项耗时；不在慢请求捕获范围内时为空操作
+    timings = _current.get()
+    if timings is not None:
+        timings.add(part, seconds)
+
+
+class SlowRequestLog:
+    """慢请求捕获：阈值为 0 时关闭，track() 只多一次属性判断。"""
+
+    def __init__(self, threshold: float, size: int) -> None:
+        self.threshold = threshold
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self._inflight: Dict[int, Timings] = {}
+        self._watchdog: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def set_threshold(self, threshold: float) -> None:
+        self.threshold = threshold
+        if threshold > 0:
+            self._ensure_watchdog()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return list(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @contextmanager
+    def track(self, kind: str, name: str) -> Iterator[None]:
+        if not self.threshold:
+            yield
+            return
+        self._ensure_watchdog()
+        timings = Timings(kind, name)
+        token = _current.set(timings)
+        self._inflight[id(timings)] = timings
+        try:
+            yield
+        finally:
+            _current.reset(token)
+            self._inflight.pop(id(timings), None)
+            elapsed = time.perf_counter() - timings.start
+            if self.threshold and elapsed >= self.threshold:
+                self._record(timings, elapsed)
+
+    def _record(self, timings: Timings, elapsed: float) -> None:
+        parts = {
+            part: {"ms": round(seconds * 1000, 3), "count": int(count)}
+            for part, (seconds, count) in timings.parts.items()
+        }
+        accounted = sum(seconds for seconds, _ in timings.parts.values())
+        self._entries.append(
+            {
+                "kind": timings.kind,
+                "name": timings.name,
+                "started_at": datetime.fromtimestamp(
+                    timings.started_at, timezone.utc
+                ).isoformat(),
+                "total_ms": round(elapsed * 1000, 3),
+                "breakdown": parts,
+                # 未归入任何分项的时间：Python 代码、JSON 编码、事件循环排队等
+                "other_ms": round(max(0.0, elapsed - accounted) * 1000, 3),
+                "thread_stack": timings.thread_stack,
+                "task_stack": timings.task_stack,
+            }
+        )
+
+    def _ensure_watchdog(self) -> None:
+        if self._watchdog is not None and self._watchdog.is_alive():
+            return
+        with self._lock:
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(
+                    target=self._watch, name="slow-request-watchdog", daemon=True
+                )
+                self._watchdog.start()
+
+    def _watch(self) -> None:
+        # 阈值关闭后退出；重新开启时再启动
+        while self.threshold:
+            threshold = self.threshold
+            time.sleep(min(0.05, threshold / 4))
+            now = time.perf_counter()
+            frames = None
+            for timings in list(self._inflight.copy().values()):
+                if timings.thread_stack is not None or now - timings.start < threshold:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(timings.thread)
+                timings.thread_stack = (
+                    traceback.format_stack(frame) if frame is not None else []
+                )
+                if timings.task is not None:
+                    try:
+                        timings.loop.call_soon_threadsafe(_capture_task, timings)
+                    except RuntimeError:
+                        pass
+            del frames
+
+
+def _capture_task(timings: Timings) -> None:
+    # 在事件循环线程中执行：任务此时挂起在某个 await 上
+    task = timings.task
+    if task is None or task.done():
+        return
+    lines: List[str] = []
+    for frame in task.get_stack():
+        code = frame.f_code
+        lines.append(
+            f'  File "{code.co_filename}", line {frame.f_lineno}, in {code.co_name}\n'
+        )
+    timings.task_stack = lines
+
+
+profiler = SamplingProfiler()
+slow_requests = SlowRequestLog(
+    settings.slow_request_ms / 1000, settings.slow_request_log_size
+)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn: Any, *_: Any) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.thread = threading.get_ident()
+        conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn: Any, *_: Any) -> None:
+    start = conn.info.pop("query_start", None)
+    timings = _current.get()
+    if timings is not None and start is not None:
+        timings.add("db", time.perf_counter() - start)
+
+
+class SlowRequestMiddleware:
+    """纯 ASGI 中间件：对每个 REST 请求启用慢请求捕获。"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not slow_requests.threshold:
+            await self.app(scope, receive, send)
+            return
+        # 路由模板在路由匹配后才知道：先用实际路径，结束时再替换
+        with slow_requests.track("http", f'{scope["method"]} {scope["path"]}'):
+            timings = _current.get()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if timings is not None:
+                    timings.name = f'{scope["method"]} {route_template(scope)}'
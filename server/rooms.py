@@ -0,0 +1,47 @@
+from typing import FrozenSet
+
+from sqlalchemy import select
+
+from .cache import TTLCache
+from .config import settings
+from .db import SessionLocal, run_db
+from .models import ConversationMember
+
+
+def load_members(room_id: int) -> FrozenSet[int]:
+    with SessionLocal() as db:
+        return frozenset(
+            db.execute(
+                select(ConversationMember.user_id).where(
+                    ConversationMember.conversation_id == room_id
+                )
+            ).scalars()
+        )
+
+
+class RoomDirectory:
+    """活跃群的成员集合缓存：发送与扇出时按成员集合投递，不必每条消息查库。
+
+    成员变更时由 REST 接口调用 invalidate；其他 worker 上的缓存在 TTL 到期后刷新。
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._members: TTLCache[int, FrozenSet[int]] = TTLCache(maxsize, ttl)
+
+    async def members(self, room_id: int) -> FrozenSet[int]:
+        members = self._members.get(room_id)
+        if members is None:
+            members = await run_db(load_members, room_id)
+            self._members.set(room_id, members)
+        return members
+
+    def set(self, room_id: int, members: FrozenSet[int]) -> None:
+        self._members.set(room_id, members)
+
+    def invalidate(self, room_id: int) -> None:
+        self._members.pop(room_id)
+
+
+rooms = RoomDirectory(
+    maxsize=settings.room_cache_max_rooms, ttl=settings.room_cache_ttl_seconds
+)
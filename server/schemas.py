@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, EmailStr, Field
 
@@ -42,14 +42,54 @@ class AddFriendRequest(BaseModel):
 class MessageOut(BaseModel):
     id: int
     sender_id: int
-    receiver_id: int
+    # 群聊消息没有单个接收者，改由 room_id 标明所属群
+    receiver_id: Optional[int] = None
+    room_id: Optional[int] = None
     body: str
+    client_msg_id: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
 
+class MessagePage(BaseModel):
+    # 按 id 倒序（最新在前）
+    items: List[MessageOut]
+    # 下一页游标：向旧翻页时作为下次的 before_id；仅按 after_id 向新翻页时作为下次的 after_id。
+    # 没有更多数据时为 None。
+    next_cursor: Optional[int] = None
+
+
+class FriendSummaryOut(BaseModel):
+    id: int
+    email: EmailStr
+    display_name: str
+    last_message: Optional[MessageOut] = None
+    # 对方发来的未读消息数：最多计到 unread_count_cap + 1，超过上限时客户端显示为 “N+”
+    unread: int = 0
+
+
+class MarkReadRequest(BaseModel):
+    up_to: int = Field(ge=0)
+
+
+class CreateRoomRequest(BaseModel):
+    title: str = Field(min_length=1, max_length=100)
+    # 创建者自动加入，无需列出
+    member_ids: List[int] = []
+
+
+class AddRoomMemberRequest(BaseModel):
+    user_id: int
+
+
+class RoomOut(BaseModel):
+    id: int
+    title: str
+    member_count: int
+
+
 class SendMessageRequest(BaseModel):
     to_user_id: int
     body: str
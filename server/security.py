@@ -1,23 +1,111 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Optional
+from typing import Any, Callable, Optional, TypeVar
 
 import jwt
 from passlib.context import CryptContext
 
 from .config import settings
+from .metrics import HASH_SECONDS, callback_gauge
+from .profiling import add_timing
 
 
+T = TypeVar("T")
+
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 
-def hash_password(password: str) -> str:
+class HashPoolBusy(Exception):
+    """等待中的哈希任务已达上限，调用方应返回 503 让客户端稍后重试。"""
+
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def verify_password(password: str, password_hash: str) -> bool:
+def _verify(password: str, password_hash: str) -> bool:
     return pwd_context.verify(password, password_hash)
 
 
+class HashPool:
+    """pbkdf2 专用进程池：哈希计算不占用主进程的 GIL、Starlette 线程池与数据库连接。
+
+    调用方在事件循环上 await 结果，等待期间不占用任何线程；排队与执行中的任务达到
+    max_pending 时立即抛出 HashPoolBusy，避免登录风暴把所有请求拖垮。
+    """
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._executor is None:
+                # spawn：不从多线程的服务进程 fork，子进程状态干净
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        # 只在事件循环线程中调用，计数无需加锁
+        self.start()
+        if self._pending >= self.max_pending:
+            raise HashPoolBusy()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+
+hash_pool = HashPool(
+    workers=settings.hash_workers or os.cpu_count() or 1,
+    max_pending=settings.hash_queue_max,
+)
+
+
+callback_gauge(
+    "chat_password_hash_pending", "排队或执行中的密码哈希任务数", hash_pool.pending
+)
+
+
+async def hash_password(password: str) -> str:
+    start = time.perf_counter()
+    password_hash = await hash_pool.run(_hash, password)
+    elapsed = time.perf_counter() - start
+    HASH_SECONDS.labels("hash").observe(elapsed)
+    add_timing("hash", elapsed)
+    return password_hash
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    start = time.perf_counter()
+    ok = await hash_pool.run(_verify, password, password_hash)
+    elapsed = time.perf_counter() - start
+    HASH_SECONDS.labels("verify").observe(elapsed)
+    add_timing("hash", elapsed)
+    return ok
+
+
 def create_access_token(subject: str, expires_minutes: Optional[int] = None) -> str:
     expire_minutes = expires_minutes or settings.jwt_expire_minutes
     now = datetime.now(timezone.utc)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .config import settings
+from .db import SessionLocal, run_db
+from .models import ConversationMember, DeliveryState, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_watermark(user_id: int) -> int:
+    with SessionLocal() as db:
+        state = db.get(DeliveryState, user_id)
+        if state is not None:
+            return state.last_delivered_id
+        # 首次连接：从当前最新消息开始记水位，不把整段历史当作“未投递”补发
+        latest = db.execute(select(func.coalesce(func.max(Message.id), 0))).scalar()
+        # 多端同时首次连接时另一端可能已写入：不覆盖，以库中的值为准
+        db.execute(
+            insert(DeliveryState)
+            .values(user_id=user_id, last_delivered_id=latest)
+            .on_conflict_do_nothing(index_elements=[DeliveryState.user_id])
+        )
+        db.commit()
+        return db.execute(
+            select(DeliveryState.last_delivered_id).where(
+                DeliveryState.user_id == user_id
+            )
+        ).scalar_one()
+
+
+def save_watermarks(marks: Dict[int, int]) -> None:
+    # 一条多行 upsert 写入多个用户的水位；水位只前进不后退
+    stmt = insert(DeliveryState).values(
+        [{"user_id": u, "last_delivered_id": m} for u, m in marks.items()]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DeliveryState.user_id],
+        set_={
+            "last_delivered_id": func.greatest(
+                DeliveryState.last_delivered_id, stmt.excluded.last_delivered_id
+            )
+        },
+    )
+    with SessionLocal() as db:
+        db.execute(stmt)
+        db.commit()
+
+
+def _message_dict(m: Message) -> Dict[str, Any]:
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "receiver_id": m.receiver_id,
+        "conversation_key": m.conversation_key,
+        "body": m.body,
+        "client_msg_id": m.client_msg_id,
+        "created_at": m.created_at,
+    }
+
+
+def fetch_missed(user_id: int, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    # 该用户收到与发出的（含其他设备发出的）、以及所在群的所有消息中 id 大于水位的，按 id 升序
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(Message)
+            .where(
+                or_(
+                    Message.receiver_id == user_id,
+                    Message.sender_id == user_id,
+                    # 所在群的消息：群数量有限，IN 列表走 (conversation_key, id) 索引
+                    Message.conversation_key.in_(
+                        select(
+                            func.concat("g:", ConversationMember.conversation_id)
+                        ).where(ConversationMember.user_id == user_id)
+                    ),
+                ),
+                Message.id > after_id,
+            )
+            .order_by(Message.id)
+            .limit(limit)
+        ).scalars()
+        return [_message_dict(m) for m in rows]
+
+
+def load_message(message_id: int) -> Optional[Dict[str, Any]]:
+    with SessionLocal() as db:
+        m = db.get(Message, message_id)
+        return _message_dict(m) if m is not None else None
+
+
+class WatermarkStore:
+    """汇总客户端 ack 的投递水位，按固定间隔成批写库，而不是每个 ack 一次往返。"""
+
+    def __init__(self, flush_interval: float) -> None:
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def advance(self, user_id: int, message_id: int) -> None:
+        if message_id > self._pending.get(user_id, 0):
+            self._pending[user_id] = message_id
+
+    def pending_for(self, user_id: int) -> int:
+        return self._pending.get(user_id, 0)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="watermark-flusher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        marks, self._pending = self._pending, {}
+        try:
+            await run_db(save_watermarks, marks)
+        except Exception:  # noqa: BLE001
+            logger.exception("failed to save delivery watermarks")
+            # 放回待写，下次重试（保留较大值）
+            for user_id, message_id in marks.items():
+                self.advance(user_id, message_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+watermarks = WatermarkStore(flush_interval=settings.ack_flush_ms / 1000)
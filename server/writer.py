@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from .config import settings
+from .db import SessionLocal, run_db
+from .metrics import (
+    MESSAGE_PERSIST_SECONDS,
+    WRITER_BATCH_SECONDS,
+    WRITER_BATCH_SIZE,
+    callback_gauge,
+)
+from .models import Message, conversation_key, room_key
+from .profiling import add_timing
+
+
+logger = logging.getLogger(__name__)
+
+
+_Pending = Tuple[Dict[str, Any], "asyncio.Future[Dict[str, Any]]"]
+
+_COLUMNS = (
+    Message.id,
+    Message.sender_id,
+    Message.receiver_id,
+    Message.conversation_key,
+    Message.body,
+    Message.client_msg_id,
+    Message.created_at,
+)
+
+
+def _insert_batch(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 一条多行 INSERT ... ON CONFLICT DO NOTHING RETURNING，一次提交（一次 fsync）。
+    # 以 (sender_id, client_msg_id) 对应回每一行；冲突（重发）的行返回已有的消息。
+    with SessionLocal() as db:
+        stmt = (
+            insert(Message)
+            .on_conflict_do_nothing(index_elements=["sender_id", "client_msg_id"])
+            .returning(*_COLUMNS)
+        )
+        found = {
+            (r.sender_id, r.client_msg_id): (r._asdict(), True)
+            for r in db.execute(stmt, rows)
+        }
+        missing = [
+            (row["sender_id"], row["client_msg_id"])
+            for row in rows
+            if (row["sender_id"], row["client_msg_id"]) not in found
+        ]
+        if missing:
+            existing = db.execute(
+                select(*_COLUMNS).where(
+                    tuple_(Message.sender_id, Message.client_msg_id).in_(missing)
+                )
+            )
+            for r in existing:
+                found[(r.sender_id, r.client_msg_id)] = (r._asdict(), False)
+        db.commit()
+
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for row in rows:
+        key = (row["sender_id"], row["client_msg_id"])
+        message, created = found[key]
+        # 同一批内重复的幂等键只有第一条算新写入
+        out.append({**message, "created": created and key not in seen})
+        seen.add(key)
+    return out
+
+
+class MessageWriter:
+    """写后（write-behind）消息写入器：汇总所有连接的待写消息，按时间窗或条数成批提交。"""
+
+    def __init__(self, batch_size: int, flush_interval: float) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue[Optional[_Pending]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name="message-writer")
+
+    async def stop(self) -> None:
+        if self._task is None or self._queue is None:
+            return
+        # 哨兵：先把已排队的消息写完再退出
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(
+        self,
+        sender_id: int,
+        receiver_id: Optional[int],
+        body: str,
+        client_msg_id: Optional[str] = None,
+        room_id: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        # 返回落库后的消息；created 为 False 表示同一幂等键的消息此前已写入。
+        # 群聊消息传 room_id，receiver_id 为 None
+        if self._queue is None:
+            raise RuntimeError("MessageWriter not started")
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future[Dict[str, Any]] = loop.create_future()
+        row = {
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "conversation_key": (
+                room_key(room_id)
+                if room_id is not None
+                else conversation_key(sender_id, receiver_id)
+            ),
+            "body": body,
+            # 未提供幂等键时由服务端生成，保证每行都能与 RETURNING 结果对应
+            "client_msg_id": client_msg_id or f"s-{uuid.uuid4().hex}",
+        }
+        start = time.perf_counter()
+        self._queue.put_nowait((row, fut))
+        message = await fut
+        elapsed = time.perf_counter() - start
+        MESSAGE_PERSIST_SECONDS.observe(elapsed)
+        add_timing("persist", elapsed)
+        return message
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch: List[_Pending] = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            WRITER_BATCH_SIZE.observe(len(batch))
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[_Pending]) -> None:
+        rows = [row for row, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = await run_db(_insert_batch, rows)
+            WRITER_BATCH_SECONDS.observe(time.perf_counter() - start)
+        except Exception:  # noqa: BLE001
+            if len(batch) == 1:
+                logger.exception("message insert failed")
+                self._fail(batch[0][1], "message insert failed")
+                return
+            results = None
+        if results is None:
+            # 整批失败（如某行外键无效）时逐行重试，只让出错的发送方失败
+            logger.warning(
+                "batch insert of %d messages failed, retrying row by row", len(batch)
+            )
+            for pending in batch:
+                await self._flush([pending])
+            return
+        for (_, fut), message in zip(batch, results):
+            if not fut.done():
+                fut.set_result(message)
+
+    @staticmethod
+    def _fail(fut: "asyncio.Future[Dict[str, Any]]", detail: str) -> None:
+        if not fut.done():
+            fut.set_exception(RuntimeError(detail))
+
+
+message_writer = MessageWriter(
+    batch_size=settings.writer_batch_size,
+    flush_interval=settings.writer_flush_ms / 1000,
+)
+
+callback_gauge(
+    "chat_writer_queue_depth", "等待写入器落库的消息数", message_writer.pending
+)
@@ -1,97 +1,306 @@
-from typing import Dict
+import asyncio
+import time
+from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from sqlalchemy.exc import SQLAlchemyError
 
-from .deps import get_current_user, get_db
-from .models import Message, User
+from .backplane import backplane
+from .config import settings
+from .connections import Connection, ConnectionRegistry
+from .db import run_db
+from .deps import authenticate_token, cached_user, load_user, peek_user
+from .frames import dumps, message_frame
+from .heartbeat import heartbeat
+from .metrics import FANOUT_SECONDS, FRAMES_IN, KNOWN_FRAME_TYPES, callback_gauge
+from .models import room_id_of
+from .profiling import slow_requests
+from .rooms import rooms
+from .sync import fetch_missed, load_message, load_watermark, watermarks
+from .writer import message_writer
 
 
 router = APIRouter()
 
 
-active_connections: Dict[int, WebSocket] = {}
+registry = ConnectionRegistry()
+
+callback_gauge("chat_ws_connections", "在线 WebSocket 连接数", registry.count)
+callback_gauge("chat_ws_users", "在线用户数（多端登录只计一次）", registry.user_count)
+callback_gauge(
+    "chat_ws_send_queue_depth",
+    "出站队列深度：所有连接合计与单个连接最大值",
+    lambda: dict(zip((("total",), ("max",)), registry.queue_depths())),
+    ["agg"],
+)
+
+
+def _count_frame_in(kind: Any) -> str:
+    label = kind if kind in KNOWN_FRAME_TYPES else "other"
+    FRAMES_IN.labels(label).inc()
+    return label
+
+
+def _message_payload(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": message["id"],
+        "sender_id": message["sender_id"],
+        "receiver_id": message["receiver_id"],
+        # 群聊消息的群 id；单聊为 None
+        "room_id": room_id_of(message["conversation_key"]),
+        "body": message["body"],
+        "client_msg_id": message["client_msg_id"],
+        "created_at": message["created_at"].isoformat(),
+    }
+
+
+async def deliver_local(
+    user_id: int, frame: str, exclude: Optional[int], message_id: int
+) -> None:
+    # 由投递总线调用：放入本进程内该用户所有连接（多端登录）的出站队列，不等待对端
+    for conn in registry.for_user(user_id):
+        if conn.id != exclude:
+            conn.send(frame, message_id)
+
+
+async def deliver_room_local(
+    room_id: int, frame: str, exclude: Optional[int], message_id: int
+) -> None:
+    # 由投递总线调用：同一个已编码的帧放入本进程内所有在线成员的连接
+    members = await rooms.members(room_id)
+    for conn in registry.for_users(members):
+        if conn.id != exclude:
+            conn.send(frame, message_id)
+
+
+async def load_message_frame(frame_type: str, message_id: int) -> Optional[str]:
+    # 由投递总线调用：超出 NOTIFY 上限的消息只转发了 id，在此从库中读取并重建帧
+    message = await run_db(load_message, message_id)
+    if message is None:
+        return None
+    return message_frame(frame_type, dumps(_message_payload(message)))
+
+
+async def _sync_missed(conn: Connection) -> None:
+    # 从投递水位开始分批补发离线期间的消息，代价与错过的消息数成正比。
+    # 补发期间实时帧先暂存，结束后再按顺序发出，客户端收到的消息 id 保持递增。
+    conn.hold()
+    last_id = 0
+    try:
+        # 尚未写库的 ack 水位同样有效，避免快速重连时重复补发
+        last_id = max(
+            await run_db(load_watermark, conn.user_id),
+            watermarks.pending_for(conn.user_id),
+        )
+        total = 0
+        while True:
+            batch = await run_db(
+                fetch_missed, conn.user_id, last_id, settings.sync_batch_size
+            )
+            total += len(batch)
+            truncated = total >= settings.sync_max_messages
+            done = len(batch) < settings.sync_batch_size or truncated
+            first_id = 0
+            if batch:
+                first_id, last_id = batch[0]["id"], batch[-1]["id"]
+            conn.enqueue(
+                dumps(
+                    {
+                        "type": "sync",
+                        "messages": [_message_payload(m) for m in batch],
+                        "done": done,
+                        "truncated": truncated,
+                    }
+                ),
+                last_id,
+                first_id,
+            )
+            if done:
+                break
+    finally:
+        conn.release(skip_upto=last_id)
+
+
+def _ack(conn: Connection, up_to: int) -> None:
+    # 客户端确认已收到 id 不超过 up_to 的消息；宽限期后再推进投递水位
+    conn.confirm(up_to)
+    asyncio.get_running_loop().call_later(
+        settings.ack_grace_ms / 1000, _apply_ack, conn, up_to
+    )
+
+
+def _apply_ack(conn: Connection, up_to: int) -> None:
+    # 连接已关闭时，宽限期内乱序到达的消息可能没能进入它，放弃这次推进（重连补发会多发几条，
+    # 客户端按 id 去重）；lossy 连接无法判断客户端收到了什么，同样不采信
+    if conn.closed or conn.lossy:
+        return
+    # 不超过写任务实际写出的最大 id，也不越过出站顺序上尚未确认或仍在排队的较小 id
+    up_to = min(up_to, conn.sent_up_to)
+    floor = conn.ack_floor()
+    if floor is not None:
+        up_to = min(up_to, floor)
+    watermarks.advance(conn.user_id, up_to)
+
+
+async def _user_exists(user_id: int) -> bool:
+    # 命中鉴权用户缓存时不查库；未命中时在 DB 线程池中查询并写入缓存
+    if cached_user(user_id) is not None:
+        return True
+    return await run_db(load_user, user_id) is not None
+
+
+def _send_error(
+    conn: Connection, detail: str, client_msg_id: Any, retryable: bool
+) -> None:
+    # 发送失败的错误帧带回 client_msg_id：客户端据此把永久失败移出发送缓冲，可重试的稍后重发
+    conn.send(
+        dumps(
+            {
+                "type": "error",
+                "detail": detail,
+                "client_msg_id": client_msg_id,
+                "retryable": retryable,
+            }
+        )
+    )
+
+
+async def _handle_send(conn: Connection, data: Dict[str, Any]) -> None:
+    user_id = conn.user_id
+    room_id: Optional[int] = None
+    to_user_id: Optional[int] = None
+    client_msg_id = data.get("client_msg_id")
+    # 与 ack 一样校验 id 字段：格式错误只回错误帧，不断开连接
+    try:
+        if data.get("room_id") is not None:
+            room_id = int(data["room_id"])
+        else:
+            to_user_id = int(data["to_user_id"])
+    except (KeyError, TypeError, ValueError):
+        _send_error(conn, "Invalid recipient", client_msg_id, False)
+        return
+    try:
+        if room_id is not None:
+            # 成员集合来自缓存，发送路径通常不查库
+            allowed = user_id in await rooms.members(room_id)
+        else:
+            assert to_user_id is not None
+            # 接收方不存在的行会让整批 INSERT 因外键失败，在进入写入器之前拒绝
+            allowed = await _user_exists(to_user_id)
+    except SQLAlchemyError:
+        # 缓存未命中时查库失败：与写入器失败一样按可重试处理
+        _send_error(conn, "Send failed", client_msg_id, True)
+        return
+    if not allowed:
+        detail = "Not a room member" if room_id is not None else "Unknown recipient"
+        _send_error(conn, detail, client_msg_id, False)
+        return
+    if "body" not in data:
+        _send_error(conn, "Invalid message", client_msg_id, False)
+        return
+    body = str(data["body"])
+    if client_msg_id is not None:
+        client_msg_id = str(client_msg_id)
+        if not client_msg_id or len(client_msg_id) > 64:
+            _send_error(conn, "Invalid client_msg_id", data["client_msg_id"], False)
+            return
+    # 交给写后写入器成批落库；提交完成后才发送 sent/recv，保持原有的顺序保证
+    try:
+        message = await message_writer.submit(
+            user_id, to_user_id, body, client_msg_id, room_id=room_id
+        )
+    except RuntimeError:
+        # 写入器停止或落库失败：同一 client_msg_id 重发是幂等的
+        _send_error(conn, "Send failed", client_msg_id, True)
+        return
+    # 消息体只编码一次，sent/recv 帧及所有接收端连接复用同一字符串
+    payload = dumps(_message_payload(message))
+    sent = message_frame("sent", payload)
+
+    message_id = message["id"]
+
+    # 发给自己客户端确认；重发（幂等键已存在）时返回原消息
+    conn.send(sent, message_id)
+    if not message["created"]:
+        return
+
+    start = time.perf_counter()
+    if room_id is not None:
+        # 群消息：同一个 recv 帧扇出给所有在线成员（含自己的其他设备）
+        await backplane.publish_room(
+            room_id,
+            message_frame("recv", payload),
+            exclude=conn.id,
+            message_id=message_id,
+        )
+        FANOUT_SECONDS.labels("room").observe(time.perf_counter() - start)
+        return
+    assert to_user_id is not None
+    # 经投递总线推送给对方（对方可能连在其他 worker 上）
+    await backplane.publish(
+        to_user_id, message_frame("recv", payload), message_id=message_id
+    )
+    # 同步给自己的其他在线设备
+    await backplane.publish(user_id, sent, exclude=conn.id, message_id=message_id)
+    FANOUT_SECONDS.labels("direct").observe(time.perf_counter() - start)
 
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    conn: Optional[Connection] = None
     try:
         # 第一条消息应包含 token，用于鉴权。格式：{"type":"auth","token":"..."}
         init = await websocket.receive_json()
+        _count_frame_in(init.get("type"))
         if init.get("type") != "auth":
             await websocket.close(code=4401)
             return
-        token = init.get("token")
-        # 复用 HTTP auth 依赖较复杂，这里直接解码。
-        from .security import decode_access_token
-        from sqlalchemy import select
-
-        try:
-            payload = decode_access_token(token)
-            user_id = int(payload.get("sub"))
-        except Exception:  # noqa: BLE001
-            await websocket.close(code=4401)
-            return
-        user = db.get(User, user_id)
-        if not user:
+        token = str(init.get("token"))
+        # 与 HTTP 鉴权共用 token / 用户缓存；未命中时在 DB 线程池中解码并查询
+        user = peek_user(token)
+        if user is None:
+            with slow_requests.track("ws", "ws auth"):
+                user = await run_db(authenticate_token, token)
+        if user is None:
             await websocket.close(code=4401)
             return
+        user_id = user.id
 
-        active_connections[user_id] = websocket
-        await websocket.send_json({"type": "ready", "user_id": user_id})
+        conn = registry.register(user_id, websocket)
+        conn.start()
+        heartbeat.add(conn)
+        conn.send(dumps({"type": "ready", "user_id": user_id}))
+        # 先注册再补发：补发期间到达的新消息被暂存，不会遗漏
+        with slow_requests.track("ws", "ws sync"):
+            await _sync_missed(conn)
 
         while True:
             data = await websocket.receive_json()
-            if data.get("type") == "send":
-                to_user_id = int(data["to_user_id"])
-                body = str(data["body"])
-                message = Message(sender_id=user_id, receiver_id=to_user_id, body=body)
-                db.add(message)
-                db.commit()
-                db.refresh(message)
-
-                # 发给自己客户端确认
-                await websocket.send_json(
-                    {
-                        "type": "sent",
-                        "message": {
-                            "id": message.id,
-                            "sender_id": message.sender_id,
-                            "receiver_id": message.receiver_id,
-                            "body": message.body,
-                            "created_at": message.created_at.isoformat(),
-                        },
-                    }
-                )
-
-                # 若对方在线，推送
-                peer = active_connections.get(to_user_id)
-                if peer is not None:
-                    await peer.send_json(
-                        {
-                            "type": "recv",
-                            "message": {
-                                "id": message.id,
-                                "sender_id": message.sender_id,
-                                "receiver_id": message.receiver_id,
-                                "body": message.body,
-                                "created_at": message.created_at.isoformat(),
-                            },
-                        }
+            conn.last_seen = time.monotonic()
+            kind = data.get("type")
+            label = _count_frame_in(kind)
+            if kind == "pong":
+                continue
+            with slow_requests.track("ws", f"ws {label}"):
+                if kind == "send":
+                    await _handle_send(conn, data)
+                elif kind == "ack":
+                    try:
+                        up_to = int(data["up_to"])
+                    except (KeyError, TypeError, ValueError):
+                        conn.send(dumps({"type": "error", "detail": "Invalid ack"}))
+                    else:
+                        _ack(conn, up_to)
+                else:
+                    conn.send(
+                        dumps({"type": "error", "detail": "Unknown message type"})
                     )
-            else:
-                await websocket.send_json(
-                    {"type": "error", "detail": "Unknown message type"}
-                )
     except WebSocketDisconnect:
         pass
     finally:
         # 清理连接
-        to_remove = None
-        for uid, ws in active_connections.items():
-            if ws is websocket:
-                to_remove = uid
-                break
-        if to_remove is not None:
-            active_connections.pop(to_remove, None)
+        if conn is not None:
+            heartbeat.remove(conn)
+            registry.unregister(conn)
+            await conn.close()